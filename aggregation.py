@@ -0,0 +1,147 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from bootstrap import partition_pattern, select_partitions
+from schema import DAILY, compact
+
+# Columns of the per-day series, the same as `steps.data_steps.daily_aggregates` returns
+DAILY_COLUMNS = ['timestamp', 'transactions_per_day', 'amount_sum', 'amount', 'CTA_sum', 'CTA']
+
+
+def daily_pipeline(time_field: str = 'timestamp', start=None, end=None) -> list[dict]:
+    '''The function `daily_pipeline` builds the MongoDB aggregation pipeline collapsing transactions to one
+    document per UTC day, in day order.
+
+    Parameters
+    ----------
+    time_field : str, optional
+        The date field of the transactions.
+    start : datetime, optional
+        The inclusive lower bound of the transactions, no bound when not given.
+    end : datetime, optional
+        The exclusive upper bound of the transactions, no bound when not given.
+
+    Returns
+    -------
+        The pipeline stages. `$dateFromParts` is used rather than `$dateTrunc` so servers before 5.0 run it.
+    '''
+    stages = []
+    if start is not None or end is not None:
+        bounds = {}
+        if start is not None:
+            bounds['$gte'] = pd.Timestamp(start).to_pydatetime()
+        if end is not None:
+            bounds['$lt'] = pd.Timestamp(end).to_pydatetime()
+        stages.append({'$match': {time_field: bounds}})
+    date = f'${time_field}'
+    stages += [
+        {'$group': {
+            '_id': {'$dateFromParts': {'year': {'$year': date}, 'month': {'$month': date}, 'day': {'$dayOfMonth': date}}},
+            'transactions_per_day': {'$sum': 1},
+            # The server switches a sum of longs to a double when it would overflow
+            'amount_sum': {'$sum': '$amount'},
+            'CTA_sum': {'$sum': '$CTA'},
+        }},
+        {'$sort': {'_id': 1}},
+    ]
+    return stages
+
+
+def _finish(days: pd.DataFrame) -> pd.DataFrame:
+    '''Derive the per-transaction means from the per-day counts and sums and order the columns.'''
+    if days.empty:
+        return pd.DataFrame({column: pd.Series(dtype='datetime64[s]' if column == 'timestamp' else 'float64')
+                             for column in DAILY_COLUMNS})
+    days = days.assign(amount=days['amount_sum'] / days['transactions_per_day'],
+                       CTA=days['CTA_sum'] / days['transactions_per_day'])
+    return compact(days[DAILY_COLUMNS].reset_index(drop=True), DAILY)
+
+
+class MongoDailyAggregator:
+    '''The class `MongoDailyAggregator` runs the per-day aggregation on the MongoDB server, so only one
+    document per day crosses the network whatever the number of transactions.
+
+    Parameters
+    ----------
+    db : pymongo.database.Database
+        The database of the transactions.
+    collection_name : str
+        The transactions collection, e.g. 'Clean_Transactions_Data'.
+    layout : str, optional
+        The layout of the collection, see `bootstrap.LAYOUTS`. With the monthly layout each partition is
+    aggregated on its own, a UTC day never spans two of them.
+    '''
+
+    def __init__(self, db, collection_name: str, layout: str = 'plain'):
+        self.db = db
+        self.collection_name = collection_name
+        self.layout = layout
+
+    def _collections(self, start=None, end=None) -> list[str]:
+        if self.layout != 'monthly':
+            return [self.collection_name]
+        names = self.db.list_collection_names(filter={'name': {'$regex': partition_pattern(self.collection_name)}})
+        return select_partitions(names, self.collection_name, start, end)
+
+    def daily(self, start=None, end=None) -> pd.DataFrame:
+        '''Return the per-day series of the transactions in [start, end), see `DAILY_COLUMNS`.'''
+        documents = []
+        for name in self._collections(start, end):
+            documents += list(self.db[name].aggregate(daily_pipeline('timestamp', start, end), allowDiskUse=True))
+        days = pd.DataFrame(documents, columns=['_id', 'transactions_per_day', 'amount_sum', 'CTA_sum'])
+        days = days.rename(columns={'_id': 'timestamp'}).astype({'amount_sum': float, 'CTA_sum': float})
+        return _finish(days)
+
+
+class ParquetDailyAggregator:
+    '''The class `ParquetDailyAggregator` is the local stand-in of `MongoDailyAggregator` over the Parquet
+    dataset of the clean transactions. The dataset is scanned one record batch at a time and only the
+    per-day partial counts and sums of each batch are kept, so memory scales with the number of days.
+
+    Parameters
+    ----------
+    path : str
+        The Parquet dataset directory written by `steps.storage_steps.save_clean_data`.
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _filter(self, dataset, start=None, end=None):
+        timestamp_type = dataset.schema.field('timestamp').type
+        expression = None
+        for bound, compare in ((start, pc.greater_equal), (end, pc.less)):
+            if bound is None:
+                continue
+            bound = pd.Timestamp(bound)
+            if timestamp_type.tz is not None and bound.tzinfo is None:
+                bound = bound.tz_localize('UTC')
+            elif timestamp_type.tz is None and bound.tzinfo is not None:
+                bound = bound.tz_convert('UTC').tz_localize(None)
+            condition = compare(ds.field('timestamp'), pa.scalar(bound, type=timestamp_type))
+            expression = condition if expression is None else expression & condition
+        return expression
+
+    def daily(self, start=None, end=None) -> pd.DataFrame:
+        '''Return the per-day series of the transactions in [start, end), see `DAILY_COLUMNS`.'''
+        dataset = ds.dataset(self.path, format='parquet', partitioning='hive')
+        scanner = dataset.scanner(columns=['timestamp', 'amount', 'CTA'], filter=self._filter(dataset, start, end))
+        partials = []
+        for batch in scanner.to_batches():
+            if batch.num_rows == 0:
+                continue
+            table = pa.table({
+                'timestamp': pc.floor_temporal(batch.column('timestamp'), unit='day'),
+                'amount': pc.cast(batch.column('amount'), pa.float64(), safe=False),
+                'CTA': pc.cast(batch.column('CTA'), pa.float64(), safe=False),
+            })
+            partials.append(table.group_by('timestamp').aggregate([('amount', 'count', pc.CountOptions(mode='all')), ('amount', 'sum'), ('CTA', 'sum')]))
+        if not partials:
+            return _finish(pd.DataFrame())
+        # A day can span batches, the partial counts and sums add up
+        totals = pa.concat_tables(partials).group_by('timestamp').aggregate(
+            [('amount_count', 'sum'), ('amount_sum', 'sum'), ('CTA_sum', 'sum')])
+        days = totals.to_pandas().rename(columns={'amount_count_sum': 'transactions_per_day',
+                                                  'amount_sum_sum': 'amount_sum', 'CTA_sum_sum': 'CTA_sum'})
+        return _finish(days.sort_values('timestamp'))
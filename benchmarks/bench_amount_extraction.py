@@ -0,0 +1,50 @@
+import json
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from steps.data_steps import extract_amount, extract_amounts
+
+
+def make_transactions(rows: int, missing_ratio: float = 0.05, seed: int = 0) -> pd.Series:
+    '''The function `make_transactions` builds a column of parsed `tx` dicts shaped like the raw data,
+    with a share of transactions missing their amount.'''
+    rng = np.random.default_rng(seed)
+    amounts = rng.integers(1, 10**12, rows)
+    missing = rng.random(rows) < missing_ratio
+    return pd.Series([{'hash': f'0x{i:x}'} if missing[i] else {'hash': f'0x{i:x}', 'amount': str(amounts[i])}
+                      for i in range(rows)])
+
+
+def regex_path(tx: pd.Series) -> pd.Series:
+    '''The previous path: serialize every dict in `load_json`, then regex each row in `remove_columns`.'''
+    amounts = tx.apply(lambda x: json.dumps(x)).apply(extract_amount)
+    return amounts.fillna(amounts.mode()[0]).astype(int)
+
+
+def columnar_path(tx: pd.Series) -> pd.Series:
+    '''The columnar path: read `tx.amount` straight from the parsed dicts.'''
+    amounts = extract_amounts(tx)
+    return amounts.fillna(amounts.mode()[0]).astype(int)
+
+
+def run(rows: int, repeat: int) -> None:
+    tx = make_transactions(rows)
+    expected = regex_path(tx)
+    assert (columnar_path(tx).values == expected.values).all(), "Columnar path disagrees with the regex path"
+
+    for name, func in [('regex', regex_path), ('columnar', columnar_path)]:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(tx)
+            best = min(best, time.perf_counter() - start)
+        print(f"{name:>10}: {rows / best:>14,.0f} rows/sec ({best:.3f}s for {rows:,} rows)")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark amount extraction in remove_columns")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run(args.rows, args.repeat)
@@ -0,0 +1,61 @@
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from forecasters import FORECASTERS
+from storage import read_arrow
+from utils import load_config
+
+
+def make_daily(days: int, seed: int = 0) -> pd.DataFrame:
+    '''The function `make_daily` builds a daily series shaped like the project's transactions per day: a
+    trend, a weekly cycle and noise.'''
+    rng = np.random.default_rng(seed)
+    t = np.arange(days)
+    weekly = np.array([0.9, 1.0, 1.0, 1.05, 1.15, 1.3, 0.6])
+    y = (2_000 + 2 * t) * weekly[t % 7] + rng.normal(0, 80, days)
+    return pd.DataFrame({'timestamp': pd.date_range('2023-01-01', periods=days, freq='D'), 'transactions_per_day': y})
+
+
+def load_daily(path: str, days: int) -> pd.DataFrame:
+    '''The daily aggregates written by the data pipeline, or a synthetic series when there are none.'''
+    if path and os.path.exists(path):
+        print(f"Using the daily aggregates in '{path}'")
+        return read_arrow(path)
+    print(f"No daily aggregates at '{path}', using a synthetic series of {days} days")
+    return make_daily(days)
+
+
+def run(path: str, feature: str, days: int, horizon: int, repeat: int) -> None:
+    daily = load_daily(path, days)
+    history = daily[['timestamp', feature]].rename(columns={'timestamp': 'ds', feature: 'y'}).sort_values('ds', ignore_index=True)
+    train, test = history.iloc[:-horizon], history['y'].to_numpy()[-horizon:]
+    options = load_config('config.yaml').get('model_pipeline', {})
+
+    for name, forecaster in FORECASTERS.items():
+        best = float('inf')
+        try:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                forecast = forecaster(train, horizon, options.get(name) or {})
+                best = min(best, time.perf_counter() - start)
+        except ImportError as e:
+            print(f"{name:>15}: skipped, {e}")
+            continue
+        error = np.abs(forecast['yhat'].to_numpy() - test)
+        mape = np.mean(error / np.maximum(np.abs(test), 1e-9)) * 100
+        print(f"{name:>15}: {best * 1000:>10.1f} ms fit+predict, MAE {error.mean():>12,.2f}, MAPE {mape:>6.2f}% "
+              f"over {horizon} held-out days of {len(train)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the forecasting backends on held-out days")
+    parser.add_argument('--daily', default=load_config('config.yaml')['paths'].get('daily_data_file'),
+                        help="Arrow file of daily aggregates, a synthetic series is used if it does not exist")
+    parser.add_argument('--feature', default='transactions_per_day')
+    parser.add_argument('--days', type=int, default=730, help="Length of the synthetic series")
+    parser.add_argument('--horizon', type=int, default=28)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run(args.daily, args.feature, args.days, args.horizon, args.repeat)
@@ -0,0 +1,192 @@
+import copy
+import json
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import argparse
+from datetime import datetime, timezone
+import numpy as np
+import psutil
+import database
+from database import build_mongo_uri
+from utils import load_config
+from steps.data_steps import add_time_features, aggregate_daily, calculate_transactions_per_day, generate_CTA, load_json, remove_columns, save_to_mongoDB
+from steps.model_steps import aggregate_daily_series, clean_data, forecast_and_save
+from steps.storage_steps import load_arrow, load_forecasts, save_clean_data
+from steps.synthetic_data_steps import generate_transactions, modify_forecasts, save_transactions_data_to_mongodb
+from storage import forecast_path
+
+# Raw input sizes selectable with --scales
+SCALES = {'10k': 10_000, '100k': 100_000, '1M': 1_000_000, '10M': 10_000_000}
+
+
+def make_raw_file(path: str, rows: int, days: int = 365, seed: int = 0, chunk_size: int = 1_000_000) -> None:
+    '''The function `make_raw_file` writes an NDJSON `transactions.json` of `rows` records spread over
+    `days` days, shaped like the raw data: an epoch `timestamp` and a `tx` dict with a string `amount`.'''
+    rng = np.random.default_rng(seed)
+    start = int(datetime(2023, 1, 1, tzinfo=timezone.utc).timestamp())
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        for offset in range(0, rows, chunk_size):
+            n = min(chunk_size, rows - offset)
+            timestamps = np.sort(rng.integers(start, start + days * 86_400, n))
+            amounts = rng.integers(10**15, 10**18, n)
+            f.write(''.join(f'{{"timestamp": {t}, "tx": {{"hash": "0x{offset + i:x}", "amount": "{a}"}}}}\n'
+                            for i, (t, a) in enumerate(zip(timestamps.tolist(), amounts.tolist()))))
+    os.replace(path + '.tmp', path)
+
+
+class PeakRSS:
+    '''Sample the resident set size of the process in a background thread while the block runs.'''
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self) -> None:
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.process.memory_info().rss
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss)
+
+
+def _entrypoint(step):
+    # ZenML steps run their plain function through `entrypoint` outside of a pipeline
+    return getattr(step, 'entrypoint', step)
+
+
+def measure(results: list, context: dict, name: str, rows, step, *args):
+    '''Run one step, append its wall time, peak RSS and throughput to `results` and return its output.
+    `rows` is the number of rows the step handles, or None to count the rows it returns.'''
+    with PeakRSS() as rss:
+        start = time.perf_counter()
+        output = _entrypoint(step)(*args)
+        seconds = time.perf_counter() - start
+    rows = len(output) if rows is None and output is not None else rows or 0
+    result = dict(context, step=name, seconds=round(seconds, 4), peak_rss_mb=round(rss.peak / 2**20, 1),
+                  rows=rows, rows_per_sec=round(rows / seconds, 1) if seconds > 0 else None)
+    results.append(result)
+    print(f"{context['scale']:>5} {name:<48} {seconds:>9.2f} s {result['peak_rss_mb']:>9.1f} MB "
+          f"{result['rows_per_sec'] or 0:>14,.0f} rows/s")
+    return output
+
+
+def run_scale(config: dict, raw_path: str, scale: str, work_dir: str, context: dict) -> list:
+    '''The function `run_scale` runs every step of the three pipelines in order on one raw file, the way the
+    pipeline functions chain them with the default local handoff and MongoDB publishing.'''
+    config = copy.deepcopy(config)
+    config['paths'].update({
+        'clean_data_file': os.path.join(work_dir, 'clean_data.parquet'),
+        'daily_data_file': os.path.join(work_dir, 'daily_data.arrow'),
+        'transactions_per_day_output_file': os.path.join(work_dir, 'transactions_per_day.arrow'),
+        'cta_output_file': os.path.join(work_dir, 'transaction_amount_per_day.arrow'),
+        'predicted_data_directory': work_dir,
+    })
+    paths = config['paths']
+    uri = build_mongo_uri(config)
+    db = "Transactions_Database"
+    batch_size = config['mongodb'].get('batch_size', 10_000)
+    workers = config['mongodb'].get('write_workers', 1)
+    seed = config.get('random', {}).get('seed')
+    data_config = config.get('data_pipeline', {})
+    context = dict(context, scale=scale)
+    results = []
+
+    # Data pipeline
+    df = measure(results, context, 'data.load_json', None, load_json, raw_path, True, data_config.get('chunk_size', 100_000))
+    rows = len(df)
+    df = measure(results, context, 'data.remove_columns', rows, remove_columns, df, ['amount', 'timestamp'])
+    df = measure(results, context, 'data.add_time_features', rows, add_time_features, df,
+                 data_config.get('time_features'), data_config.get('time_feature_options'))
+    df = measure(results, context, 'data.generate_CTA', rows, generate_CTA, df, seed)
+    df = measure(results, context, 'data.calculate_transactions_per_day', rows, calculate_transactions_per_day, df)
+    measure(results, context, 'data.save_clean_data', rows, save_clean_data, df, paths['clean_data_file'], paths['daily_data_file'])
+    measure(results, context, 'data.save_to_mongoDB', rows, save_to_mongoDB, df, uri, db, "Clean_Transactions_Data", batch_size, workers)
+    daily_df = measure(results, context, 'data.aggregate_daily', rows, aggregate_daily, df)
+    measure(results, context, 'data.save_to_mongoDB[daily]', len(daily_df), save_to_mongoDB, daily_df, uri, db, "Daily_Transactions_Data", batch_size, workers)
+    del df
+
+    # Model pipeline
+    transaction_df = measure(results, context, 'model.load_arrow', None, load_arrow, paths['daily_data_file'])
+    # The daily_source: aggregate alternatives, grouping the clean transactions where they are stored
+    measure(results, context, 'model.aggregate_daily_series[parquet]', rows, aggregate_daily_series, uri, db,
+            "Clean_Transactions_Data", 'plain', paths['clean_data_file'])
+    measure(results, context, 'model.aggregate_daily_series[mongo]', rows, aggregate_daily_series, uri, db,
+            "Clean_Transactions_Data", 'plain')
+    cleaned_df = measure(results, context, 'model.clean_data', None, clean_data, transaction_df)
+    model_config = config.get('model_pipeline', {})
+    backends = model_config.get('backends') or {}
+    for feature in ['transactions_per_day', 'CTA']:
+        backend = backends.get(feature, 'prophet')
+        measure(results, context, f'model.forecast_and_save[{feature}]', len(cleaned_df), forecast_and_save, cleaned_df, db, feature, uri,
+                batch_size, forecast_path(config, feature), True, None, model_config.get(backend) or {}, backend)
+
+    # Synthetic data pipeline
+    combined_df = measure(results, context, 'synthetic.load_forecasts', None, load_forecasts,
+                          [forecast_path(config, "transactions_per_day"), forecast_path(config, "CTA")])
+    combined_df = measure(results, context, 'synthetic.modify_forecasts', None, modify_forecasts, combined_df, 5, 5, 5, 19)
+    combined_df = measure(results, context, 'synthetic.generate_transactions', None, generate_transactions, combined_df, seed)
+    generated = int(combined_df['transactions_per_day_forecast'].sum())
+    measure(results, context, 'synthetic.save_transactions_data_to_mongodb', generated, save_transactions_data_to_mongodb,
+            combined_df, uri, db, "synthetic_Transactions", batch_size, workers, seed)
+    return results
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def run(scales: list[str], data_dir: str, output: str, days: int) -> None:
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit("The pipeline benchmark needs the in-process MongoDB stand-in: pip install mongomock")
+
+    config = load_config('config.yaml')
+    # Every step gets its client from database.get_client, which hands out the pooled client of the URI
+    client = mongomock.MongoClient()
+    database._clients[build_mongo_uri(config)] = client
+    database._clients[None] = client
+
+    context = {'commit': _commit(), 'run_at': datetime.now(timezone.utc).isoformat()}
+    for scale in scales:
+        raw_path = os.path.join(data_dir, f'transactions_{scale}.json')
+        if not os.path.exists(raw_path):
+            print(f"Generating {SCALES[scale]:,} raw transactions in '{raw_path}'")
+            make_raw_file(raw_path, SCALES[scale], days)
+        for name in client.list_database_names():
+            client.drop_database(name)
+        with tempfile.TemporaryDirectory() as work_dir:
+            results = run_scale(config, raw_path, scale, work_dir, context)
+        with open(output, 'a') as f:
+            for result in results:
+                f.write(json.dumps(result) + '\n')
+    print(f"Results appended to '{output}'")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline step end to end against an in-process MongoDB")
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=['10k', '1M'])
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'transactions_bench'),
+                        help="Directory of the generated raw files, reused across runs")
+    parser.add_argument('--output', default='benchmarks/results.jsonl', help="JSON lines file the results are appended to")
+    parser.add_argument('--days', type=int, default=365, help="Days the raw transactions are spread over")
+    args = parser.parse_args()
+    run(args.scales, args.data_dir, args.output, args.days)
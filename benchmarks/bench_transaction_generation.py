@@ -0,0 +1,46 @@
+import time
+import argparse
+import numpy as np
+from utils import generate_random_transactions_CTA, generate_transactions_batch
+
+
+def make_forecast(days: int, transactions: int, seed: int = 0):
+    '''The function `make_forecast` builds CTA and transactions per day forecasts for `days` days with
+    around `transactions` transactions each.'''
+    rng = np.random.default_rng(seed)
+    counts = rng.integers(transactions // 2, transactions * 3 // 2, days)
+    targets = counts * rng.integers(1_000, 100_000, days)
+    return targets, counts
+
+
+def loop_path(targets, counts) -> list:
+    '''The previous path: one `generate_random_transactions_CTA` call per day with scalar indexing.'''
+    return [generate_random_transactions_CTA(targets[idx], counts[idx]) for idx in range(len(targets))]
+
+
+def batch_path(targets, counts):
+    '''The vectorized path: every day in one `generate_transactions_batch` call.'''
+    return generate_transactions_batch(targets, counts, seed=0)
+
+
+def run(days: int, transactions: int, repeat: int) -> None:
+    targets, counts = make_forecast(days, transactions)
+    amounts, offsets = batch_path(targets, counts)
+    assert (np.add.reduceat(amounts, offsets[:-1]) == targets).all(), "Batch generator missed a daily target"
+
+    for name, func in [('loop', loop_path), ('batch', batch_path)]:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(targets, counts)
+            best = min(best, time.perf_counter() - start)
+        print(f"{name:>6}: {best * 1000:>10.1f} ms for {days} days, {counts.sum():,} transactions")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark synthetic transaction generation")
+    parser.add_argument('--days', type=int, default=100)
+    parser.add_argument('--transactions', type=int, default=20_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run(args.days, args.transactions, args.repeat)
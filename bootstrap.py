@@ -0,0 +1,206 @@
+import re
+import pandas as pd
+from pymongo import ASCENDING
+from database import get_client, write_frame
+
+# Layouts a transactions collection can be stored in: one indexed collection, a MongoDB 5.0+
+# time-series collection, or one indexed collection per month named '<collection>_YYYY_MM'
+LAYOUTS = ('plain', 'timeseries', 'monthly')
+
+# Time field, optional time-series meta field and indexes of the collections the pipelines write
+COLLECTIONS = {
+    'Clean_Transactions_Data': {'time_field': 'timestamp', 'indexes': [[('timestamp', ASCENDING)]]},
+    'Daily_Transactions_Data': {'time_field': 'timestamp', 'indexes': [[('timestamp', ASCENDING)]], 'unique': True},
+    'Forecasts': {'time_field': 'timestamp', 'indexes': [[('timestamp', ASCENDING)]], 'unique': True},
+    'synthetic_Transactions': {'time_field': 'Timestamp', 'meta_field': 'scenario',
+                               # (Timestamp, _id) is the keyset order of date-filtered API pages
+                               'indexes': [[('Timestamp', ASCENDING), ('_id', ASCENDING)],
+                                           [('scenario', ASCENDING), ('Timestamp', ASCENDING), ('_id', ASCENDING)]]},
+}
+
+
+def layout_of(config: dict, collection_name: str) -> str:
+    '''The function `layout_of` returns the layout of a collection from `mongodb.layouts` in `config.yaml`,
+    'plain' when it is not configured.'''
+    layout = (config.get('mongodb', {}).get('layouts') or {}).get(collection_name) or 'plain'
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout '{layout}' for '{collection_name}', expected one of {LAYOUTS}")
+    # Upserts by day need a unique index on one collection, which time-series collections do not allow
+    if layout != 'plain' and COLLECTIONS.get(collection_name, {}).get('unique'):
+        raise ValueError(f"'{collection_name}' is upserted by its unique timestamp and only supports the 'plain' layout")
+    return layout
+
+
+def check_layouts(config: dict) -> None:
+    '''The function `check_layouts` validates the `mongodb.layouts` of `config.yaml` against the rest of the
+    configuration and raises a `ValueError` for a combination the pipelines cannot run.
+
+    Incremental data pipeline runs publish by updating Clean_Transactions_Data in place (deleting the
+    leftovers of a failed run and recounting the days they touch), which needs its 'plain' layout.
+    '''
+    for collection_name in COLLECTIONS:
+        layout_of(config, collection_name)
+    storage = config.get('storage', {})
+    publish = storage.get('publish_to_mongo', True) or storage.get('handoff', 'local') != 'local'
+    incremental = config.get('data_pipeline', {}).get('incremental', False)
+    clean_layout = layout_of(config, 'Clean_Transactions_Data')
+    if incremental and publish and clean_layout != 'plain':
+        raise ValueError(f"data_pipeline.incremental publishes to Clean_Transactions_Data in place and needs its "
+                         f"'plain' layout, not '{clean_layout}'. Use the plain layout or turn incremental runs off.")
+
+
+def partition_name(collection_name: str, month: pd.Timestamp) -> str:
+    '''Return the name of the monthly partition of `collection_name` holding `month`.'''
+    return f"{collection_name}_{month.year:04d}_{month.month:02d}"
+
+
+def partition_pattern(collection_name: str) -> str:
+    '''Return the regular expression matching the names of the monthly partitions of `collection_name`.'''
+    return f"^{re.escape(collection_name)}_\\d{{4}}_\\d{{2}}$"
+
+
+def _utc_naive(bound) -> pd.Timestamp:
+    # Partitions are split by UTC month, see `write_collection`
+    bound = pd.Timestamp(bound)
+    return bound.tz_convert('UTC').tz_localize(None) if bound.tzinfo is not None else bound
+
+
+def select_partitions(names: list[str], collection_name: str, start=None, end=None) -> list[str]:
+    '''The function `select_partitions` picks, in month order, the monthly partitions of `collection_name`
+    among the collection `names` of a database that can hold timestamps in [start, end).
+
+    Parameters
+    ----------
+    names : list[str]
+        The collection names of the database.
+    collection_name : str
+        The partitioned collection.
+    start : datetime, optional
+        The inclusive lower bound, no bound when not given. A timezone-aware bound is converted to UTC.
+    end : datetime, optional
+        The exclusive upper bound, no bound when not given. A timezone-aware bound is converted to UTC.
+
+    Returns
+    -------
+        The names of the partitions to query.
+
+    Examples
+    --------
+    >>> select_partitions(['T_2024_01', 'T_2024_02', 'T_2024_03'], 'T', start='2024-02-01T00:30+05:00')
+    ['T_2024_01', 'T_2024_02', 'T_2024_03']
+    >>> select_partitions(['T_2024_01', 'T_2024_02', 'T_2024_03'], 'T', end='2024-02-29T22:00-05:00')
+    ['T_2024_01', 'T_2024_02', 'T_2024_03']
+    '''
+    pattern = re.compile(partition_pattern(collection_name))
+    first = partition_name(collection_name, _utc_naive(start)) if start is not None else None
+    last = partition_name(collection_name, _utc_naive(end) - pd.Timedelta(microseconds=1)) if end is not None else None
+    # Zero-padded names sort in month order
+    return [name for name in sorted(names) if pattern.match(name)
+            and (first is None or name >= first) and (last is None or name <= last)]
+
+
+def ensure_indexes(collection, spec_name: str = None) -> None:
+    '''Create the indexes of `COLLECTIONS[spec_name]` (by default the collection's own name) on a
+    collection. Creating an existing index is a no-op on the server.'''
+    spec = COLLECTIONS[spec_name or collection.name]
+    for keys in spec['indexes']:
+        collection.create_index(keys, unique=spec.get('unique', False) and len(keys) == 1)
+
+
+def ensure_collection(db, collection_name: str, layout: str = 'plain') -> None:
+    '''The function `ensure_collection` prepares a collection of `COLLECTIONS` for its layout: a
+    time-series collection is created if it does not exist yet, and the indexes of the collection, or of
+    every existing monthly partition, are created.'''
+    spec = COLLECTIONS[collection_name]
+    if layout == 'monthly':
+        for name in db.list_collection_names(filter={'name': {'$regex': partition_pattern(collection_name)}}):
+            ensure_indexes(db[name], collection_name)
+        return
+    if layout == 'timeseries':
+        existing = {info['name']: info for info in db.list_collections(filter={'name': collection_name})}
+        if collection_name not in existing:
+            timeseries = {'timeField': spec['time_field'], 'granularity': 'seconds'}
+            if spec.get('meta_field'):
+                timeseries['metaField'] = spec['meta_field']
+            db.create_collection(collection_name, timeseries=timeseries)
+        elif existing[collection_name].get('type') != 'timeseries':
+            print(f"Collection '{collection_name}' already exists as a regular collection, drop it to recreate it as a time-series collection")
+    ensure_indexes(db[collection_name])
+
+
+def bootstrap(config: dict, mongo_uri: str = None) -> None:
+    '''The function `bootstrap` creates the indexes, time-series collections and monthly partition indexes
+    of every collection in `COLLECTIONS` with the layouts set in `config.yaml`. It is idempotent and runs
+    when the API starts, so range reads on 'timestamp' and 'Timestamp' never scan a whole collection.
+    Layouts rejected by `check_layouts` raise a `ValueError` before anything is created.
+
+    Parameters
+    ----------
+    config : dict
+        The loaded `config.yaml`.
+    mongo_uri : str, optional
+        The URI string for connecting to the MongoDB server, built from `config` when not given.
+    '''
+    check_layouts(config)
+    db = get_client(mongo_uri, config)[config['mongodb']['database_name']]
+    for collection_name in COLLECTIONS:
+        ensure_collection(db, collection_name, layout_of(config, collection_name))
+    print(f"Indexes of {sorted(COLLECTIONS)} are in place")
+
+
+def clear_collection(db, collection_name: str, layout: str = 'plain', query: dict = None) -> int:
+    '''The function `clear_collection` deletes the documents matching `query` (all of them by default)
+    from a collection in any layout and returns how many were deleted.
+
+    A time-series collection is dropped and created again when it is cleared completely, as older servers
+    only delete time-series documents by their meta field.
+    '''
+    query = query or {}
+    if layout == 'monthly':
+        names = db.list_collection_names(filter={'name': {'$regex': partition_pattern(collection_name)}})
+        deleted = 0
+        for name in names:
+            if query:
+                deleted += db[name].delete_many(query).deleted_count
+            else:
+                deleted += db[name].estimated_document_count()
+                db[name].drop()
+        return deleted
+    collection = db[collection_name]
+    if layout == 'timeseries' and not query:
+        deleted = collection.estimated_document_count()
+        collection.drop()
+        ensure_collection(db, collection_name, layout)
+        return deleted
+    return collection.delete_many(query).deleted_count
+
+
+def write_collection(db, collection_name: str, df: pd.DataFrame, layout: str = 'plain', batch_size: int = 10_000, workers: int = 1) -> dict:
+    '''The function `write_collection` writes a DataFrame to a collection in any layout. With the monthly
+    layout the rows are split by the month of the collection's time field, each month going to its own
+    partition. The indexes of `COLLECTIONS` are created once the rows are written.
+
+    Returns
+    -------
+        The write statistics, see `BulkWriter.close`, summed over the partitions.
+    '''
+    if layout != 'monthly':
+        stats = write_frame(db[collection_name], df, batch_size, workers)
+        # Building the indexes after the bulk load is cheaper than maintaining them during it
+        if collection_name in COLLECTIONS:
+            ensure_indexes(db[collection_name], collection_name)
+        return stats
+    time_field = COLLECTIONS[collection_name]['time_field']
+    timestamps = pd.to_datetime(df[time_field])
+    if timestamps.dt.tz is not None:
+        timestamps = timestamps.dt.tz_convert('UTC').dt.tz_localize(None)
+    months = timestamps.dt.to_period('M')
+    totals = {'collection': collection_name, 'documents': 0, 'batches': 0, 'seconds': 0.0}
+    for month, part in df.groupby(months.to_numpy(), sort=True):
+        partition = db[partition_name(collection_name, month.to_timestamp())]
+        stats = write_frame(partition, part, batch_size, workers)
+        ensure_indexes(partition, collection_name)
+        for key in ('documents', 'batches', 'seconds'):
+            totals[key] += stats[key]
+    totals['docs_per_sec'] = totals['documents'] / totals['seconds'] if totals['seconds'] > 0 else 0.0
+    return totals
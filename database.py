@@ -0,0 +1,368 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import quote_plus
+import bson
+import pandas as pd
+import pyarrow as pa
+from bson.codec_options import CodecOptions
+from pymongo import MongoClient
+from pymongo.collection import Collection
+from motor.motor_asyncio import AsyncIOMotorClient
+from utils import load_config
+from instrumentation import mongo_listener
+
+try:
+    # Optional, decodes BSON straight into Arrow columns without building a dict per document
+    from pymongoarrow.api import find_arrow_all
+except ImportError:
+    find_arrow_all = None
+
+# Process-wide clients, one connection pool per URI
+_clients = {}
+_async_clients = {}
+_clients_lock = threading.Lock()
+
+# Documents per cursor batch of the bulk readers, large batches cut round trips on big collections
+READ_BATCH_SIZE = 50_000
+
+# config.yaml keys under `mongodb.pool` and the MongoClient options they map to
+_POOL_OPTIONS = {
+    'max_pool_size': 'maxPoolSize',
+    'min_pool_size': 'minPoolSize',
+    'max_idle_time_ms': 'maxIdleTimeMS',
+    'connect_timeout_ms': 'connectTimeoutMS',
+    'socket_timeout_ms': 'socketTimeoutMS',
+    'server_selection_timeout_ms': 'serverSelectionTimeoutMS',
+    'wait_queue_timeout_ms': 'waitQueueTimeoutMS',
+    'compressors': 'compressors',
+}
+
+
+def build_mongo_uri(config: dict) -> str:
+    '''The function `build_mongo_uri` builds the MongoDB connection URI from the `mongodb` section of
+    `config.yaml`, escaping the user name and password.'''
+    username = quote_plus(config['mongodb']['user_name'])
+    password = quote_plus(config['mongodb']['user_password'])
+    uri_start = config['mongodb']['uri_start']
+    uri_end = config['mongodb']['uri_end']
+    return uri_start + username + ':' + password + '@' + uri_end
+
+
+def client_options(config: dict) -> dict:
+    '''The function `client_options` translates the `mongodb.pool` section of `config.yaml` into
+    `MongoClient` keyword arguments.'''
+    pool = config.get('mongodb', {}).get('pool') or {}
+    return {_POOL_OPTIONS[key]: value for key, value in pool.items() if key in _POOL_OPTIONS and value is not None}
+
+
+def _pooled_client(clients: dict, factory, mongo_uri: str, config: dict):
+    '''Return the cached client for `mongo_uri` from `clients`, creating it with `factory` on first use.
+    The client for the URI built from `config.yaml` is also cached under `None`.'''
+    client = clients.get(mongo_uri)
+    if client is not None:
+        return client
+    with _clients_lock:
+        if mongo_uri not in clients:
+            if config is None:
+                config = load_config('config.yaml')
+            uri = mongo_uri or build_mongo_uri(config)
+            if uri not in clients:
+                # The listener counts the round trips and bytes of every step for /metrics
+                clients[uri] = factory(uri, event_listeners=[mongo_listener], **client_options(config))
+            clients[mongo_uri] = clients[uri]
+        return clients[mongo_uri]
+
+
+def get_client(mongo_uri: str = None, config: dict = None) -> MongoClient:
+    '''The function `get_client` hands out the process-wide pooled `MongoClient` for a URI, creating it
+    on first use.
+
+    A `MongoClient` is thread-safe and keeps its own connection pool, so sharing one per URI means the SRV
+    lookup, TLS and handshake costs are paid once per process instead of once per step or request.
+
+    Parameters
+    ----------
+    mongo_uri : str, optional
+        The URI string for connecting to the MongoDB server, built from `config` when not given.
+    config : dict, optional
+        The loaded `config.yaml`, read from the working directory when not given. Its `mongodb.pool`
+        section sets the pool size, timeouts and compression of a newly created client.
+
+    Returns
+    -------
+    pymongo.MongoClient
+        The shared client for `mongo_uri`.
+    '''
+    return _pooled_client(_clients, MongoClient, mongo_uri, config)
+
+
+def get_async_client(mongo_uri: str = None, config: dict = None) -> AsyncIOMotorClient:
+    '''The function `get_async_client` is the `motor` counterpart of `get_client` for the FastAPI app.
+    Call it from inside the running event loop, the client is then shared with the same `mongodb.pool`
+    options as the blocking one.'''
+    return _pooled_client(_async_clients, AsyncIOMotorClient, mongo_uri, config)
+
+
+def close_clients() -> None:
+    '''The function `close_clients` closes every pooled client, e.g. when the API shuts down.'''
+    with _clients_lock:
+        # The same client can be cached under its URI and under None
+        unique = {id(client): client for client in list(_clients.values()) + list(_async_clients.values())}
+        for client in unique.values():
+            client.close()
+        _clients.clear()
+        _async_clients.clear()
+
+
+class BulkWriter:
+    '''The class `BulkWriter` streams documents into one MongoDB collection in fixed-size, unordered
+    `insert_many` batches, optionally spreading the batches over a thread pool.
+
+    Documents are buffered until `batch_size` of them are collected, so memory stays bounded by
+    `batch_size` documents per in-flight batch no matter how much is written. Use it as a context
+    manager, or call `close` to flush the last partial batch and get the write statistics.
+
+    Parameters
+    ----------
+    collection : pymongo.collection.Collection
+        The collection to write to. Reuse one client for all writers of a run.
+    batch_size : int, optional
+        The number of documents sent per `insert_many` round trip.
+    workers : int, optional
+        The number of threads sending batches concurrently, 1 sends them from the calling thread.
+    '''
+
+    def __init__(self, collection, batch_size: int = 10_000, workers: int = 1):
+        self.collection = collection
+        self.batch_size = max(int(batch_size), 1)
+        self.workers = max(int(workers), 1)
+        self.documents = 0
+        self.batches = 0
+        self._buffer = []
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        self._start = time.perf_counter()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def write(self, records) -> None:
+        '''Queue an iterable of documents, sending a batch every time `batch_size` of them are buffered.'''
+        for record in records:
+            self._buffer.append(record)
+            if len(self._buffer) >= self.batch_size:
+                self._flush()
+
+    def write_frame(self, df: pd.DataFrame) -> None:
+        '''Queue the rows of a DataFrame, converting them to documents one batch at a time.'''
+        for start in range(0, len(df), self.batch_size):
+            self.write(df.iloc[start:start + self.batch_size].to_dict(orient='records'))
+
+    def _flush(self) -> None:
+        if not self._buffer:
+            return
+        batch, self._buffer = self._buffer, []
+        if self._executor is None:
+            self._send(batch)
+            return
+        # Bound the number of batches held in memory while waiting for the pool
+        while len(self._pending) >= 2 * self.workers:
+            done, self._pending = wait(self._pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+        # Run in a copy of the caller's context so the batch is attributed to the calling step
+        self._pending.add(self._executor.submit(contextvars.copy_context().run, self._send, batch))
+
+    def _send(self, batch: list) -> None:
+        self.collection.insert_many(batch, ordered=False)
+        with self._lock:
+            self.documents += len(batch)
+            self.batches += 1
+
+    def close(self) -> dict:
+        '''Flush the remaining documents, wait for in-flight batches and report the write rate.
+
+        Returns
+        -------
+            A dict with the collection name, the number of documents and batches written, the elapsed
+        seconds and the documents per second.
+        '''
+        self._flush()
+        if self._executor is not None:
+            try:
+                for future in self._pending:
+                    future.result()
+            finally:
+                self._pending = set()
+                self._executor.shutdown(wait=True)
+                self._executor = None
+        elapsed = time.perf_counter() - self._start
+        stats = {
+            'collection': self.collection.name,
+            'documents': self.documents,
+            'batches': self.batches,
+            'seconds': elapsed,
+            'docs_per_sec': self.documents / elapsed if elapsed > 0 else 0.0,
+        }
+        print(f"Wrote {stats['documents']} documents to '{stats['collection']}' in {stats['batches']} batches "
+              f"({stats['docs_per_sec']:,.0f} docs/sec)")
+        return stats
+
+
+def write_frame(collection, df: pd.DataFrame, batch_size: int = 10_000, workers: int = 1) -> dict:
+    '''The function `write_frame` writes a whole DataFrame to a collection through a `BulkWriter`.
+
+    Parameters
+    ----------
+    collection : pymongo.collection.Collection
+        The collection to write to.
+    df : pd.DataFrame
+        The rows to write, one document per row.
+    batch_size : int, optional
+        The number of documents per `insert_many` batch.
+    workers : int, optional
+        The number of threads sending batches concurrently.
+
+    Returns
+    -------
+        The write statistics returned by `BulkWriter.close`.
+    '''
+    writer = BulkWriter(collection, batch_size, workers)
+    try:
+        writer.write_frame(df)
+    finally:
+        stats = writer.close()
+    return stats
+
+
+def _projection(fields: list[str] = None) -> dict:
+    if fields is None:
+        return {'_id': 0}
+    projection = {field: 1 for field in fields}
+    if '_id' not in fields:
+        projection['_id'] = 0
+    return projection
+
+
+def _document_batches(collection, query: dict, fields: list[str], batch_size: int, sort: list = None, limit: int = 0):
+    '''Yield the matching documents one cursor batch at a time as lists of dicts. The raw BSON of a batch
+    is decoded in a single `bson.decode_all` call, which saves the per-document cursor overhead but still
+    builds a Python dict per document. Collections without raw batch support fall back to a regular
+    cursor.'''
+    projection = _projection(fields)
+    try:
+        raw_batches = collection.find_raw_batches(query, projection, batch_size=batch_size, sort=sort, limit=limit)
+    except NotImplementedError:
+        raw_batches = None
+    if raw_batches is not None:
+        codec_options = CodecOptions(document_class=dict)
+        for raw in raw_batches:
+            yield bson.decode_all(raw, codec_options)
+        return
+    batch = []
+    for document in collection.find(query, projection, batch_size=batch_size, sort=sort, limit=limit):
+        batch.append(document)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _batch_table(documents: list[dict], fields: list[str] = None) -> pa.Table:
+    '''Turn a batch of documents into an Arrow table, gathering each field into a Python list first.'''
+    if fields is None:
+        # Field order of first appearance, documents of one collection rarely differ
+        fields = list(dict.fromkeys(key for document in documents for key in document))
+    return pa.table({field: pa.array([document.get(field) for document in documents]) for field in fields})
+
+
+def _to_frame(tables: list[pa.Table]) -> pd.DataFrame:
+    # Batches can infer different types for a field, e.g. null in one and int64 in the next
+    return pa.concat_tables(tables, promote_options='permissive').to_pandas(split_blocks=True, self_destruct=True)
+
+
+def iter_frames(collection, query: dict = None, fields: list[str] = None, batch_size: int = READ_BATCH_SIZE,
+                chunk_size: int | None = 1_000_000, sort: list = None, limit: int = 0):
+    '''The function `iter_frames` reads the matching documents of a collection as a sequence of DataFrames,
+    for results too large to load at once.
+
+    Only the requested fields are sent by the server, `_id` is left out unless it is asked for. Documents
+    are decoded to Python dicts one cursor batch at a time and each batch is turned into Arrow columns
+    before the next is decoded, so at most one batch of dicts and one chunk of columns exist at a time.
+
+    Parameters
+    ----------
+    collection : pymongo.collection.Collection
+        The collection to read.
+    query : dict, optional
+        The filter of the documents to read, all of them when not given.
+    fields : list[str], optional
+        The fields to read, every field but `_id` when not given.
+    batch_size : int, optional
+        The number of documents per cursor batch.
+    chunk_size : int, optional
+        The approximate number of rows per yielded DataFrame, chunks end on a batch boundary. `None` yields
+    a single DataFrame.
+    sort : list, optional
+        (key, direction) pairs the documents are sorted by.
+    limit : int, optional
+        The largest number of documents to read, 0 for all of them.
+
+    Returns
+    -------
+        A generator of DataFrames with one column per field, nothing is yielded when nothing matches.
+    '''
+    tables, rows = [], 0
+    for documents in _document_batches(collection, query or {}, fields, batch_size, sort, limit):
+        tables.append(_batch_table(documents, fields))
+        rows += len(documents)
+        if chunk_size is not None and rows >= chunk_size:
+            yield _to_frame(tables)
+            tables, rows = [], 0
+    if tables:
+        yield _to_frame(tables)
+
+
+def read_frame(collection, query: dict = None, fields: list[str] = None, batch_size: int = READ_BATCH_SIZE,
+               sort: list = None, limit: int = 0) -> pd.DataFrame:
+    '''The function `read_frame` reads the matching documents of a collection into one DataFrame.
+
+    Only the requested fields are sent by the server, `_id` is left out unless it is asked for. When
+    pymongoarrow is installed the raw BSON of a pymongo collection is decoded straight into Arrow columns.
+    Otherwise the batches of `iter_frames` are read and joined.
+
+    Parameters
+    ----------
+    collection : pymongo.collection.Collection
+        The collection to read.
+    query : dict, optional
+        The filter of the documents to read, all of them when not given.
+    fields : list[str], optional
+        The fields to read, every field but `_id` when not given.
+    batch_size : int, optional
+        The number of documents per cursor batch.
+    sort : list, optional
+        (key, direction) pairs the documents are sorted by.
+    limit : int, optional
+        The largest number of documents to read, 0 for all of them.
+
+    Returns
+    -------
+        A DataFrame with one column per field, empty when nothing matches.
+    '''
+    if find_arrow_all is not None and isinstance(collection, Collection):
+        table = find_arrow_all(collection, query or {}, projection=_projection(fields), batch_size=batch_size,
+                               sort=sort, limit=limit)
+        if table.num_rows == 0:
+            return pd.DataFrame(columns=fields)
+        return table.to_pandas(split_blocks=True, self_destruct=True)
+    for df in iter_frames(collection, query, fields, batch_size, chunk_size=None, sort=sort, limit=limit):
+        return df
+    return pd.DataFrame(columns=fields)
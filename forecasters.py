@@ -0,0 +1,120 @@
+import numpy as np
+import pandas as pd
+
+# Registry of forecasting backends, name -> function(history, periods, options) returning the forecast
+FORECASTERS = {}
+
+# Backend used for features without an entry in `model_pipeline.backends`
+DEFAULT_FORECASTER = 'prophet'
+
+def register_forecaster(name: str):
+    '''The function `register_forecaster` is a decorator that adds a forecasting backend to the
+    `FORECASTERS` registry under the given name.
+
+    Parameters
+    ----------
+    name : str
+        The name the backend is selected by in `config.yaml`.
+
+    Returns
+    -------
+        A decorator registering a function that takes the 'ds' and 'y' history in date order, the number
+    of days to forecast and a dict of options, and returns a DataFrame with the 'ds' and 'yhat' columns of
+    the `periods` days following the history.
+
+    '''
+    def decorator(func):
+        FORECASTERS[name] = func
+        return func
+    return decorator
+
+def get_forecaster(name: str):
+    '''Return the registered backend called `name`, raising a `KeyError` naming the known ones otherwise.'''
+    if name not in FORECASTERS:
+        raise KeyError(f"Unknown forecaster '{name}', registered forecasters are {sorted(FORECASTERS)}")
+    return FORECASTERS[name]
+
+def _daily(history: pd.DataFrame) -> tuple[np.ndarray, pd.Timestamp]:
+    '''Return the history as one float value per calendar day, missing days interpolated, and its last day.'''
+    series = history.set_index(pd.to_datetime(history['ds']).dt.normalize())['y'].astype(float)
+    series = series.groupby(level=0).mean()
+    series = series.reindex(pd.date_range(series.index[0], series.index[-1], freq='D')).interpolate()
+    return series.to_numpy(), series.index[-1]
+
+def _future(last_day: pd.Timestamp, yhat: np.ndarray) -> pd.DataFrame:
+    return pd.DataFrame({'ds': pd.date_range(last_day + pd.Timedelta(days=1), periods=len(yhat), freq='D'), 'yhat': yhat})
+
+def fit_prophet(history: pd.DataFrame, hyperparams: dict = None, init: dict = None):
+    '''The function `fit_prophet` fits a Prophet model, optionally warm-started from the `init` parameters
+    of an earlier fit.'''
+    # Imported here, the other backends do not need Stan
+    from prophet import Prophet
+    model = Prophet(**(hyperparams or {}))
+    if init is not None:
+        model.fit(history, init=init)
+    else:
+        model.fit(history)
+    return model
+
+def predict_prophet(model, periods: int) -> pd.DataFrame:
+    '''The function `predict_prophet` returns the forecast of a fitted Prophet model for the `periods`
+    days following its history.'''
+    future = model.make_future_dataframe(periods=periods, freq='D')
+    return model.predict(future)[['ds', 'yhat']].tail(periods).reset_index(drop=True)
+
+@register_forecaster('prophet')
+def prophet(history: pd.DataFrame, periods: int, options: dict) -> pd.DataFrame:
+    '''Prophet with `options` as the model hyperparameters.'''
+    return predict_prophet(fit_prophet(history, options), periods)
+
+@register_forecaster('seasonal_naive')
+def seasonal_naive(history: pd.DataFrame, periods: int, options: dict) -> pd.DataFrame:
+    '''Repeat the last season, `options['season_length']` days (default 7).'''
+    y, last_day = _daily(history)
+    season_length = min(int(options.get('season_length', 7)), len(y))
+    return _future(last_day, np.resize(y[-season_length:], periods))
+
+@register_forecaster('holt_winters')
+def holt_winters(history: pd.DataFrame, periods: int, options: dict) -> pd.DataFrame:
+    '''Additive Holt-Winters exponential smoothing with smoothing factors `alpha` (level, default 0.3),
+    `beta` (trend, default 0.05) and `gamma` (season, default 0.2) and a `season_length` of 7 days. A
+    history shorter than two seasons is smoothed without a seasonal component.'''
+    y, last_day = _daily(history)
+    alpha = options.get('alpha', 0.3)
+    beta = options.get('beta', 0.05)
+    gamma = options.get('gamma', 0.2)
+    season_length = int(options.get('season_length', 7))
+
+    if len(y) < 2 * season_length:
+        season_length = 1
+        gamma = 0.0
+    first, second = y[:season_length], y[season_length:2 * season_length]
+    level = first.mean()
+    trend = (second.mean() - first.mean()) / season_length if len(second) else 0.0
+    seasonals = first - level
+
+    # The recursion is sequential in time, it runs once over a few hundred daily values
+    for t in range(len(y)):
+        season = seasonals[t % season_length]
+        previous_level = level
+        level = alpha * (y[t] - season) + (1 - alpha) * (level + trend)
+        trend = beta * (level - previous_level) + (1 - beta) * trend
+        seasonals[t % season_length] = gamma * (y[t] - level) + (1 - gamma) * season
+
+    steps = np.arange(1, periods + 1)
+    season_index = (len(y) + steps - 1) % season_length
+    return _future(last_day, level + steps * trend + seasonals[season_index])
+
+@register_forecaster('weekday_mean')
+def weekday_mean(history: pd.DataFrame, periods: int, options: dict) -> pd.DataFrame:
+    '''Mean of the last `options['window']` days (default 28) plus the mean offset of each weekday over
+    the same window.'''
+    y, last_day = _daily(history)
+    window = min(int(options.get('window', 28)), len(y))
+    recent = y[-window:]
+    weekdays = pd.date_range(end=last_day, periods=window, freq='D').weekday.to_numpy()
+    level = recent.mean()
+    counts = np.bincount(weekdays, minlength=7)
+    offsets = np.bincount(weekdays, weights=recent - level, minlength=7) / np.maximum(counts, 1)
+    future_weekdays = pd.date_range(last_day + pd.Timedelta(days=1), periods=periods, freq='D').weekday.to_numpy()
+    return _future(last_day, level + offsets[future_weekdays])
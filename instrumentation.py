@@ -0,0 +1,165 @@
+import contextvars
+import cProfile
+import functools
+import os
+import threading
+import time
+from datetime import datetime, timezone
+import bson
+import pandas as pd
+from pymongo import monitoring
+
+# Name of the step running in the current context, Mongo commands are attributed to it
+current_step = contextvars.ContextVar('current_step', default='none')
+
+# Settings from the `instrumentation` section of config.yaml, see `configure`
+_settings = {'mongo_bytes': False, 'profile_step': None, 'profile_directory': 'Data/Profiles'}
+
+# Metric name -> {label tuple: value}, guarded by `_lock`
+_metrics = {}
+_lock = threading.Lock()
+
+# Prometheus type and help text of every metric, in the order they are rendered
+METRICS = {
+    'pipeline_step_runs_total': ('counter', 'Step executions by outcome.'),
+    'pipeline_step_duration_seconds_total': ('counter', 'Total wall time spent in the step.'),
+    'pipeline_step_last_duration_seconds': ('gauge', 'Wall time of the latest execution of the step.'),
+    'pipeline_step_input_rows_total': ('counter', 'DataFrame rows passed to the step.'),
+    'pipeline_step_output_rows_total': ('counter', 'DataFrame rows returned by the step.'),
+    'pipeline_step_output_bytes': ('gauge', 'Memory footprint of the DataFrame returned by the latest execution.'),
+    'mongo_commands_total': ('counter', 'MongoDB commands (round trips) by step, command and outcome.'),
+    'mongo_command_duration_seconds_total': ('counter', 'Total time spent waiting on MongoDB commands.'),
+    'mongo_bytes_sent_total': ('counter', 'BSON bytes of the MongoDB commands sent.'),
+    'mongo_bytes_received_total': ('counter', 'BSON bytes of the MongoDB replies received.'),
+}
+
+
+def configure(settings: dict = None) -> None:
+    '''The function `configure` applies the `instrumentation` section of `config.yaml`.
+
+    Parameters
+    ----------
+    settings : dict, optional
+        `mongo_bytes` turns on the measurement of command and reply sizes, off by default as it encodes
+    every command and reply to BSON a second time. `profile_step` names a step whose executions are run
+    under cProfile and `profile_directory` is where the `.prof` files go.
+    '''
+    _settings.update({key: value for key, value in (settings or {}).items() if key in _settings})
+
+
+def _add(metric: str, labels: tuple, value: float) -> None:
+    with _lock:
+        series = _metrics.setdefault(metric, {})
+        series[labels] = series.get(labels, 0) + value
+
+
+def _set(metric: str, labels: tuple, value: float) -> None:
+    with _lock:
+        _metrics.setdefault(metric, {})[labels] = value
+
+
+def _rows(value) -> int:
+    return len(value) if isinstance(value, pd.DataFrame) else 0
+
+
+def _footprint(value) -> int:
+    # Shallow on purpose, object columns count one pointer per row so the cost stays O(columns)
+    return int(value.memory_usage(index=True, deep=False).sum()) if isinstance(value, pd.DataFrame) else 0
+
+
+def _profile_path(name: str) -> str:
+    os.makedirs(_settings['profile_directory'], exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+    return os.path.join(_settings['profile_directory'], f'{name}-{stamp}.prof')
+
+
+def instrumented(func):
+    '''The function `instrumented` is a decorator recording the duration, DataFrame rows in and out, the
+    memory footprint of the returned DataFrame and the MongoDB traffic of every call of a step. Put it
+    under `@step`, `functools.wraps` keeps the signature and annotations ZenML reads.
+
+    When the step is the configured `profile_step`, the call runs under cProfile and the stats are dumped
+    to the profile directory.
+    '''
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = current_step.set(name)
+        profiler = cProfile.Profile() if _settings['profile_step'] == name else None
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            if profiler is not None:
+                result = profiler.runcall(func, *args, **kwargs)
+            else:
+                result = func(*args, **kwargs)
+            status = 'ok'
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            current_step.reset(token)
+            labels = (('step', name),)
+            _add('pipeline_step_runs_total', labels + (('status', status),), 1)
+            _add('pipeline_step_duration_seconds_total', labels, elapsed)
+            _set('pipeline_step_last_duration_seconds', labels, elapsed)
+            _add('pipeline_step_input_rows_total', labels, sum(_rows(value) for value in list(args) + list(kwargs.values())))
+            if status == 'ok':
+                _add('pipeline_step_output_rows_total', labels, _rows(result))
+                _set('pipeline_step_output_bytes', labels, _footprint(result))
+            if profiler is not None:
+                profiler.dump_stats(_profile_path(name))
+    return wrapper
+
+
+class MongoMetricsListener(monitoring.CommandListener):
+    '''The class `MongoMetricsListener` counts the MongoDB round trips and bytes of the pooled clients and
+    attributes them to the step running in the context that issued them.'''
+
+    def __init__(self):
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+    def started(self, event):
+        step = current_step.get()
+        with self._pending_lock:
+            self._pending[(event.connection_id, event.request_id)] = step
+        if _settings['mongo_bytes']:
+            _add('mongo_bytes_sent_total', (('step', step),), len(bson.encode(event.command)))
+
+    def _finish(self, event, status: str, reply=None):
+        with self._pending_lock:
+            step = self._pending.pop((event.connection_id, event.request_id), current_step.get())
+        labels = (('step', step),)
+        _add('mongo_commands_total', labels + (('command', event.command_name), ('status', status)), 1)
+        _add('mongo_command_duration_seconds_total', labels, event.duration_micros / 1e6)
+        if reply is not None and _settings['mongo_bytes']:
+            _add('mongo_bytes_received_total', labels, len(bson.encode(reply)))
+
+    def succeeded(self, event):
+        self._finish(event, 'ok', event.reply)
+
+    def failed(self, event):
+        self._finish(event, 'error')
+
+
+# Registered on every pooled client by `database.get_client` and `database.get_async_client`
+mongo_listener = MongoMetricsListener()
+
+
+def render_metrics() -> str:
+    '''The function `render_metrics` returns every recorded metric in the Prometheus text exposition
+    format.'''
+    lines = []
+    with _lock:
+        snapshot = {metric: dict(series) for metric, series in _metrics.items()}
+    for metric, (kind, help_text) in METRICS.items():
+        series = snapshot.get(metric)
+        if not series:
+            continue
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} {kind}')
+        for labels, value in sorted(series.items()):
+            label_text = ','.join(f'{key}="{value_}"' for key, value_ in labels)
+            lines.append(f'{metric}{{{label_text}}} {value}' if label_text else f'{metric} {value}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,96 @@
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+
+class JobManager:
+    '''The class `JobManager` runs long jobs such as the pipeline runs behind `/make_transactions` on a
+    worker pool and keeps their status and progress so the API can answer straight away.
+
+    A job function receives a `progress(stage, completed, total)` callback and may return a dict of
+    errors, in which case the job is marked as failed. Only one job per name can be queued or running
+    at a time, submitting a duplicate returns the job already in flight.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        The number of jobs that can run at the same time.
+    max_history : int, optional
+        The number of finished jobs kept for status queries.
+    '''
+
+    def __init__(self, max_workers: int = 1, max_history: int = 100):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.max_history = max_history
+
+    def submit(self, name: str, func, *args, **kwargs) -> tuple[dict, bool]:
+        '''Queue `func(*args, progress=..., **kwargs)` as a job called `name`.
+
+        Returns
+        -------
+            The job status dict and True if a new job was created, or the status of the queued or running
+        job with the same name and False.
+        '''
+        with self._lock:
+            for job in self._jobs.values():
+                if job['name'] == name and job['status'] in ('queued', 'running'):
+                    return dict(job), False
+            job_id = uuid.uuid4().hex
+            job = {
+                'job_id': job_id,
+                'name': name,
+                'status': 'queued',
+                'progress': {'stage': None, 'completed': 0, 'total': None},
+                'errors': {},
+                'created_at': _now(),
+                'started_at': None,
+                'finished_at': None,
+            }
+            self._jobs[job_id] = job
+            self._prune()
+        self._executor.submit(self._run, job_id, func, args, kwargs)
+        return dict(job), True
+
+    def _run(self, job_id: str, func, args, kwargs) -> None:
+        self._update(job_id, status='running', started_at=_now())
+
+        def progress(stage: str, completed: int, total: int) -> None:
+            self._update(job_id, progress={'stage': stage, 'completed': completed, 'total': total})
+
+        try:
+            errors = func(*args, progress=progress, **kwargs) or {}
+            self._update(job_id, status='failed' if errors else 'succeeded', errors=errors, finished_at=_now())
+        except Exception as e:
+            self._update(job_id, status='failed', errors={'job': f"{e}\n{traceback.format_exc()}"}, finished_at=_now())
+
+    def _update(self, job_id: str, **fields) -> None:
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _prune(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if job['status'] in ('succeeded', 'failed')]
+        for job_id in finished[:max(len(finished) - self.max_history, 0)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id: str) -> dict:
+        '''Return a copy of the status of a job, or None if the id is unknown.'''
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def list(self) -> list[dict]:
+        '''Return the status of every known job, oldest first.'''
+        with self._lock:
+            return [dict(job) for job in self._jobs.values()]
+
+    def shutdown(self) -> None:
+        '''Stop accepting jobs, queued jobs that have not started are cancelled.'''
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
@@ -1,14 +1,18 @@
 import os
+import re
 import csv
 import yaml
 import json
 import logging
 from bson import ObjectId
-from fastapi import FastAPI
-from datetime import datetime
-from pymongo import MongoClient
-from urllib.parse import quote_plus
-from motor.motor_asyncio import AsyncIOMotorClient
+from typing import Optional
+from fastapi import FastAPI, HTTPException, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from datetime import datetime, timedelta, timezone
+from bootstrap import bootstrap, check_layouts, layout_of, partition_pattern, select_partitions
+from database import close_clients, get_async_client
+from instrumentation import configure as configure_instrumentation, render_metrics
+from jobs import JobManager
 from pipelines.data_pipeline import run_data_pipeline
 from pipelines.model_pipeline import run_model_pipeline
 from pipelines.synthetic_data_pipeline import run_synthetic_data_pipeline
@@ -18,14 +22,59 @@ with open("config.yaml", "r") as yamlfile:
 
 app = FastAPI()
 
+# Step timings, row counts and Mongo traffic are recorded for /metrics, optionally with a cProfile of one step
+configure_instrumentation(config.get('instrumentation'))
+
+# Pipeline runs are executed in the background so requests never wait on them
+job_manager = JobManager(max_workers=config.get('jobs', {}).get('max_workers', 1))
+
+@app.on_event("startup")
+def create_indexes():
+    # A layout the pipelines cannot run stops the API here, not at the first incremental run
+    check_layouts(config)
+    # Timestamp indexes, time-series collections and partition indexes exist before the first range read
+    try:
+        bootstrap(config)
+    except Exception as e:
+        logging.error(f"Error creating MongoDB indexes: {e}")
+
+@app.on_event("shutdown")
+def shutdown_mongo_clients():
+    # Stop the job workers and release the pooled connections shared by the API and the pipelines
+    job_manager.shutdown()
+    close_clients()
+
 @app.get("/")
 async def root():
-    return {"message": "Site is Working---Api's---You can Call---make_transactions---read_transactions_from_mongodb"}
+    return {"message": "Site is Working---Api's---You can Call---make_transactions---jobs---metrics---read_transactions_from_mongodb"}
 
-@app.get("/make_transactions")
+@app.get("/make_transactions", status_code=202)
 async def transaction_maker():
-    main()
-    return {"message": "Transactions Created"}
+    job, created = job_manager.submit('make_transactions', main)
+    message = "Transactions job started" if created else "A transactions job is already in progress"
+    return {"message": message, "job_id": job['job_id'], "status": job['status']}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/jobs")
+async def list_jobs():
+    return job_manager.list()
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'")
+    return job
+
+@app.get("/jobs/{job_id}/progress")
+async def job_progress(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job '{job_id}'")
+    return {"job_id": job_id, "status": job['status'], **job['progress']}
 
 
 class ObjectIdEncoder(json.JSONEncoder):
@@ -36,54 +85,168 @@ class ObjectIdEncoder(json.JSONEncoder):
             return o.isoformat()
         return super().default(o)
 
-@app.get("/read_transactions_from_mongodb")
-async def read_transactions_from_mongodb_endpoint():
-    # Connect to MongoDB
-    username = quote_plus(config['mongodb']['user_name'])
-    password = quote_plus(config['mongodb']['user_password'])
-    uri_start= config['mongodb']['uri_start']
-    uri_end= config['mongodb']['uri_end']
-
-    uri = uri_start + username + ':' + password +'@'+ uri_end
+document_encoder = ObjectIdEncoder()
+
+def serialize_document(doc: dict) -> dict:
+    # Make ObjectIds and datetimes JSON friendly without a dumps/loads round trip
+    return {key: document_encoder.default(value) if isinstance(value, (ObjectId, datetime)) else value
+            for key, value in doc.items()}
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def as_utc(moment):
+    # Naive datetimes are UTC, as pymongo stores and returns them
+    return moment.replace(tzinfo=timezone.utc) if moment.tzinfo is None else moment.astimezone(timezone.utc)
+
+def timestamp_cursor(doc):
+    # Cursor of a date-filtered page, '<Timestamp in epoch milliseconds>_<_id>'
+    return f"{(as_utc(doc['Timestamp']) - EPOCH) // timedelta(milliseconds=1)}_{doc['_id']}"
+
+def transactions_sort(start, end):
+    # Date-filtered pages walk the (Timestamp, _id) index from start, others the _id index
+    return [('Timestamp', 1), ('_id', 1)] if start or end else [('_id', 1)]
+
+def build_transactions_query(after, start, end, scenario=None):
+    query = {}
+    if scenario:
+        query['scenario'] = scenario
+    if start or end:
+        query['Timestamp'] = {}
+        if start:
+            query['Timestamp']['$gte'] = as_utc(start)
+        if end:
+            query['Timestamp']['$lt'] = as_utc(end)
+        if after:
+            match = re.fullmatch(r'(-?\d+)_([0-9a-f]{24})', after)
+            if not match:
+                raise HTTPException(status_code=400, detail=f"Invalid cursor '{after}'")
+            after_timestamp = EPOCH + timedelta(milliseconds=int(match.group(1)))
+            # Keyset on (Timestamp, _id): the range scan starts at the cursor's Timestamp and only the
+            # documents sharing it are compared on _id
+            query['Timestamp']['$gte'] = max(query['Timestamp'].get('$gte', after_timestamp), after_timestamp)
+            query['$or'] = [{'Timestamp': {'$gt': after_timestamp}}, {'_id': {'$gt': ObjectId(match.group(2))}}]
+    elif after:
+        if not ObjectId.is_valid(after):
+            raise HTTPException(status_code=400, detail=f"Invalid cursor '{after}'")
+        query['_id'] = {'$gt': ObjectId(after)}
+    return query
 
-    client = MongoClient(uri)
+@app.get("/read_transactions_from_mongodb")
+async def read_transactions_from_mongodb_endpoint(
+        after: Optional[str] = Query(None, description="Return documents after this cursor, the next_after of the previous page (an _id, <epoch ms>_<_id> with start or end, prefixed by YYYY_MM: for a monthly layout)"),
+        limit: Optional[int] = Query(None, ge=1, description="Page size, defaults to api.page_size. NDJSON streams everything unless set"),
+        start: Optional[datetime] = Query(None, description="Only transactions with Timestamp >= start"),
+        end: Optional[datetime] = Query(None, description="Only transactions with Timestamp < end"),
+        fields: Optional[str] = Query(None, description="Comma separated fields to return, e.g. Timestamp,Amount"),
+        format: str = Query("json", pattern="^(json|ndjson)$", description="json for one page, ndjson to stream"),
+        scenario: Optional[str] = Query(None, description="Only transactions of this synthetic data scenario")):
+    # Keyset pagination over _id, or (Timestamp, _id) with a date range, on the non-blocking motor client
+    api_config = config.get('api', {})
+    client = get_async_client(config=config)
     db = client[config['mongodb']['database_name']]
-    collection = db[config['mongodb']['collection_name']]
-
-    # Read transactions from MongoDB
-    transactions = []
-    for doc in collection.find():
-        transactions.append(doc)
-
-    # Return the transactions as JSON using the custom encoder
-    return json.loads(json.dumps(transactions, cls=ObjectIdEncoder))
+    collection_name = config['mongodb']['collection_name']
+
+    projection = [field.strip() for field in fields.split(',') if field.strip()] if fields else None
+    batch_size = api_config.get('batch_size', 1000)
+    if format == 'json':
+        limit = min(limit or api_config.get('page_size', 1000), api_config.get('max_page_size', 10000))
+
+    # Invalid cursors are rejected before a response starts streaming
+    if layout_of(config, collection_name) == 'monthly':
+        after_partition, after = split_partition_cursor(after, collection_name)
+        build_transactions_query(after, start, end, scenario)
+        documents = find_partitioned_transactions(db, collection_name, after_partition, after, start, end, scenario, projection, batch_size, limit)
+    else:
+        build_transactions_query(after, start, end, scenario)
+        documents = find_transactions(db[collection_name], after, start, end, scenario, projection, batch_size, limit)
+
+    if format == 'ndjson':
+        async def stream():
+            async for _, doc in documents:
+                yield json.dumps(doc, cls=ObjectIdEncoder) + '\n'
+
+        return StreamingResponse(stream(), media_type='application/x-ndjson')
+
+    transactions, next_after = [], None
+    async for next_after, doc in documents:
+        transactions.append(serialize_document(doc))
+    next_after = next_after if len(transactions) == limit else None
+    return {"transactions": transactions, "next_after": next_after}
+
+async def find_transactions(collection, after, start, end, scenario, projection, batch_size, limit=None):
+    # Yield (cursor, document) pairs in the order of `transactions_sort`, the cursor of a document is its
+    # _id, or its Timestamp and _id on date-filtered pages
+    query = build_transactions_query(after, start, end, scenario)
+    by_timestamp = bool(start or end)
+    # The cursor needs the Timestamp even when it is not one of the requested fields
+    drop_timestamp = by_timestamp and projection is not None and 'Timestamp' not in projection
+    if drop_timestamp:
+        projection = projection + ['Timestamp']
+    cursor = collection.find(query, projection).sort(transactions_sort(start, end)).batch_size(batch_size)
+    if limit:
+        cursor = cursor.limit(limit)
+    async for doc in cursor:
+        if not by_timestamp:
+            yield str(doc['_id']), doc
+            continue
+        after = timestamp_cursor(doc)
+        if drop_timestamp:
+            del doc['Timestamp']
+        yield after, doc
+
+def split_partition_cursor(after, collection_name):
+    # Monthly layout cursors are '<YYYY_MM of the partition>:<cursor within the partition>'
+    if not after:
+        return None, None
+    suffix, _, object_id = after.partition(':')
+    if not re.fullmatch(r'\d{4}_\d{2}', suffix):
+        raise HTTPException(status_code=400, detail=f"Invalid cursor '{after}'")
+    return f"{collection_name}_{suffix}", object_id
+
+async def find_partitioned_transactions(db, collection_name, after_partition, after, start, end, scenario, projection, batch_size, limit=None):
+    # Monthly layout: only the partitions overlapping [start, end) are read, in month then `transactions_sort` order
+    names = await db.list_collection_names(filter={'name': {'$regex': partition_pattern(collection_name)}})
+    for name in select_partitions(names, collection_name, start, end):
+        if after_partition and name < after_partition:
+            continue
+        async for cursor, doc in find_transactions(db[name], after if name == after_partition else None, start, end,
+                                                   scenario, projection, batch_size, limit):
+            yield f"{name[len(collection_name) + 1:]}:{cursor}", doc
+            if limit:
+                limit -= 1
+                if limit == 0:
+                    return
 
 def load_config(config_file):
     with open(config_file, 'r') as f:
         config = yaml.safe_load(f)
     return config
 
-def main():
+def main(progress=None):
     # Load configuration
     config = load_config('config.yaml')
     
     # Define file paths from configuration
     raw_data_file = config['paths']['raw_data_file']
 
-    # Run the ZenML pipelines
-    try:
-        run_data_pipeline(raw_data_file,config)
-    except Exception as e:
-        logging.error(f"Error executing data pipeline: {e}")
-
-    try:
-        run_model_pipeline(config)
-    except Exception as e:
-        logging.error(f"Error executing model pipeline: {e}")
-    try:
-        run_synthetic_data_pipeline(config)
-    except Exception as e:
-        logging.error(f"Error executing synthetic data pipeline: {e}")
+    # Run the ZenML pipelines, reporting each stage to the optional progress(stage, completed, total) callback
+    stages = [
+        ('data pipeline', lambda: run_data_pipeline(raw_data_file,config)),
+        ('model pipeline', lambda: run_model_pipeline(config)),
+        ('synthetic data pipeline', lambda: run_synthetic_data_pipeline(config)),
+    ]
+    errors = {}
+    for completed, (stage, run) in enumerate(stages):
+        if progress is not None:
+            progress(stage, completed, len(stages))
+        try:
+            run()
+        except Exception as e:
+            logging.error(f"Error executing {stage}: {e}")
+            errors[stage] = str(e)
+    if progress is not None:
+        progress('done', len(stages), len(stages))
+    return errors
 
 if __name__ == '__main__':
     # Configure logging
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from storage import read_arrow, write_arrow
+
+
+def data_fingerprint(df: pd.DataFrame) -> str:
+    '''The function `data_fingerprint` hashes the values of a DataFrame, ignoring its index, so the same
+    training rows always give the same fingerprint.'''
+    return hashlib.sha256(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes()).hexdigest()
+
+
+def warm_start_params(model) -> dict:
+    '''The function `warm_start_params` extracts the fitted parameters of a Prophet model in the form
+    `Prophet.fit(init=...)` accepts, so a refit on appended data starts from the previous optimum.'''
+    params = {}
+    for name in ['k', 'm', 'sigma_obs']:
+        params[name] = model.params[name][0][0] if model.mcmc_samples == 0 else np.mean(model.params[name])
+    for name in ['delta', 'beta']:
+        params[name] = model.params[name][0] if model.mcmc_samples == 0 else np.mean(model.params[name], axis=0)
+    return params
+
+
+class ModelCache:
+    '''The class `ModelCache` keeps fitted Prophet models and their forecasts on local disk, one entry per
+    feature and set of hyperparameters.
+
+    An entry stores the serialized model, the fingerprints and row count of the training data and the
+    forecast made with it. `lookup` tells the caller whether the data is unchanged (the cached forecast
+    can be reused), only appended to (the model can be refitted warm-started from the cached parameters)
+    or different (a fit from scratch is needed). The last cached day is left out of the appended-to check,
+    it is usually partial when the model is fitted and recounted by the next run.
+
+    Parameters
+    ----------
+    directory : str
+        The directory holding the cache entries, created on first write.
+    '''
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def _key(self, feature: str, hyperparams: dict) -> str:
+        # The Prophet version is part of the key, serialized models do not load across versions. Prophet is
+        # imported here and below rather than at module level, the other backends do not need Stan
+        import prophet
+        settings = json.dumps({'prophet': prophet.__version__, 'hyperparams': hyperparams}, sort_keys=True, default=str)
+        return f"{feature}-{hashlib.sha256(settings.encode()).hexdigest()[:16]}"
+
+    def _paths(self, feature: str, hyperparams: dict) -> tuple[str, str]:
+        key = self._key(feature, hyperparams)
+        return os.path.join(self.directory, key + '.json'), os.path.join(self.directory, key + '.arrow')
+
+    def lookup(self, feature: str, hyperparams: dict, history: pd.DataFrame, periods: int) -> tuple[str, object]:
+        '''Compare the training data of a feature with its cache entry.
+
+        Parameters
+        ----------
+        feature : str
+            The forecast feature.
+        hyperparams : dict
+            The keyword arguments the Prophet model is created with.
+        history : pd.DataFrame
+            The 'ds' and 'y' training rows, in date order.
+        periods : int
+            The number of forecast days.
+
+        Returns
+        -------
+            ('hit', cached forecast DataFrame) when the data and horizon are unchanged, ('warm', warm start
+        parameters) when the cached rows before the last one are unchanged and rows were only appended or
+        updated after them, or ('miss', None).
+        '''
+        from prophet.serialize import model_from_json
+        entry_path, forecast_path = self._paths(feature, hyperparams)
+        try:
+            with open(entry_path, 'r') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return 'miss', None
+        rows = entry['rows']
+        if rows == len(history) and entry['periods'] == periods and entry['fingerprint'] == data_fingerprint(history):
+            try:
+                return 'hit', read_arrow(forecast_path)
+            except FileNotFoundError:
+                pass
+        settled = max(rows - 1, 0)
+        if rows <= len(history) and entry.get('settled_fingerprint') == data_fingerprint(history.iloc[:settled]):
+            return 'warm', warm_start_params(model_from_json(entry['model']))
+        return 'miss', None
+
+    def store(self, feature: str, hyperparams: dict, history: pd.DataFrame, periods: int, model, forecast: pd.DataFrame) -> None:
+        '''Replace the cache entry of a feature with a newly fitted model and its forecast.'''
+        from prophet.serialize import model_to_json
+        entry_path, forecast_path = self._paths(feature, hyperparams)
+        os.makedirs(self.directory, exist_ok=True)
+        # The forecast must never be paired with the entry of older data if the write is interrupted
+        if os.path.exists(entry_path):
+            os.remove(entry_path)
+        write_arrow(forecast, forecast_path)
+        entry = {
+            'feature': feature,
+            'rows': len(history),
+            'periods': periods,
+            'fingerprint': data_fingerprint(history),
+            # Every row but the last, which may still change
+            'settled_fingerprint': data_fingerprint(history.iloc[:max(len(history) - 1, 0)]),
+            'model': model_to_json(model),
+        }
+        tmp_path = entry_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, entry_path)
@@ -1,6 +1,8 @@
-from urllib.parse import quote_plus
 from zenml import pipeline
-from steps.data_steps import add_time_features, calculate_transactions_per_day, generate_CTA, load_json, remove_columns,save_to_mongoDB
+from database import build_mongo_uri
+from bootstrap import check_layouts, layout_of
+from steps.storage_steps import append_clean_data, get_local_high_water_mark, save_clean_data
+from steps.data_steps import add_time_features, aggregate_daily, calculate_transactions_per_day, generate_CTA, get_high_water_mark, load_json, oldest_high_water_mark, remove_columns,save_to_mongoDB, upsert_to_mongoDB
 
 @pipeline(enable_cache=False)
 def run_data_pipeline(json_file_path: str,config):
@@ -8,15 +10,38 @@ def run_data_pipeline(json_file_path: str,config):
     if not json_file_path:
         raise ValueError("Error: JSON file path is not provided.")
 
-    # Load JSON data
-    json_data = load_json(json_file_path)
+    uri = build_mongo_uri(config)
+
+    data_pipeline_config = config.get('data_pipeline', {})
+    streaming = data_pipeline_config.get('streaming', False)
+    incremental = data_pipeline_config.get('incremental', False)
+
+    # The model pipeline reads the local files by default, MongoDB is an optional copy for other consumers
+    storage_config = config.get('storage', {})
+    local = storage_config.get('handoff', 'local') == 'local'
+    publish = storage_config.get('publish_to_mongo', True) or not local
+    check_layouts(config)
+    clean_layout = layout_of(config, "Clean_Transactions_Data")
+    clean_path = config['paths']['clean_data_file']
+    daily_path = config['paths']['daily_data_file']
+
+    # In incremental mode only raw records newer than the last saved one are processed. Each store has its
+    # own high-water mark, records are loaded from the older one and every store skips what it already holds
+    since = local_since = mongo_since = None
+    if incremental:
+        local_since = get_local_high_water_mark(clean_path) if local else None
+        mongo_since = get_high_water_mark(uri, "Transactions_Database", "Clean_Transactions_Data") if publish else None
+        since = oldest_high_water_mark(local_since, mongo_since)
+
+    # Load JSON data, parsing it in bounded chunks if configured
+    json_data = load_json(json_file_path, streaming, data_pipeline_config.get('chunk_size', 100_000), since)
 
     # Check if JSON data is loaded successfully
     if json_data is None:
         raise ValueError("Error: Failed to load JSON data.")
 
-    # Columns to keep
-    columns_to_keep = ['tx', 'timestamp']
+    # Columns to keep, `load_json` has already extracted the amount from 'tx'
+    columns_to_keep = ['amount', 'timestamp']
 
     # Remove unnecessary columns
     df = remove_columns(json_data, columns_to_keep)
@@ -26,14 +51,14 @@ def run_data_pipeline(json_file_path: str,config):
         raise ValueError("Error: Failed to remove columns.")
 
     # Add time features
-    df = add_time_features(df)
+    df = add_time_features(df, data_pipeline_config.get('time_features'), data_pipeline_config.get('time_feature_options'))
 
     # Check if time features are added successfully
     if df is None:
         raise ValueError("Error: Failed to add time features.")
 
     # Generate CTA
-    df = generate_CTA(df)
+    df = generate_CTA(df, config.get('random', {}).get('seed'))
 
     # Check if CTA is generated successfully
     if df is None:
@@ -46,14 +71,24 @@ def run_data_pipeline(json_file_path: str,config):
     if df is None:
         raise ValueError("Error: Failed to calculate transactions per day.")
 
-    username = quote_plus(config['mongodb']['user_name'])
-    password = quote_plus(config['mongodb']['user_password'])
-    uri_start= config['mongodb']['uri_start']
-    uri_end= config['mongodb']['uri_end']
-
-    uri = uri_start + username + ':' + password +'@'+ uri_end
-
-    save_to_mongoDB(df,uri,"Transactions_Database","Clean_Transactions_Data")
+    batch_size = config['mongodb'].get('batch_size', 10_000)
+    workers = config['mongodb'].get('write_workers', 1)
+
+    if incremental:
+        if local:
+            append_clean_data(df, clean_path, daily_path, local_since)
+        if publish:
+            upsert_to_mongoDB(df,uri,"Transactions_Database","Clean_Transactions_Data",mongo_since,batch_size=batch_size,workers=workers,
+                              daily_collection="Daily_Transactions_Data")
+    else:
+        if local:
+            save_clean_data(df, clean_path, daily_path)
+        if publish:
+            save_to_mongoDB(df,uri,"Transactions_Database","Clean_Transactions_Data",batch_size,workers,clean_layout)
+
+            # One row per day, the series the model pipeline is fitted on
+            daily_df = aggregate_daily(df)
+            save_to_mongoDB(daily_df,uri,"Transactions_Database","Daily_Transactions_Data",batch_size,workers)
 
 if __name__=='__main__':
     pass
@@ -1,19 +1,29 @@
-from urllib.parse import quote_plus
 import yaml
 from zenml import pipeline
+from database import build_mongo_uri
+from bootstrap import layout_of
+from storage import forecast_path
+from steps.storage_steps import load_arrow
 
-from steps.model_steps import clean_data, forecast_and_save, read_clean_data
+from steps.model_steps import aggregate_daily_series, clean_data, forecast_and_save, forecast_and_save_parallel, read_clean_data
 
 @pipeline(enable_cache=False)
 def run_model_pipeline(config):
-    # Read clean data
-    username = quote_plus(config['mongodb']['user_name'])
-    password = quote_plus(config['mongodb']['user_password'])
-    uri_start= config['mongodb']['uri_start']
-    uri_end= config['mongodb']['uri_end']
-
-    uri = uri_start + username + ':' + password +'@'+ uri_end
-    transaction_df = read_clean_data(uri,"Transactions_Database","Clean_Transactions_Data")
+    # Read the daily aggregates of the clean data, one row per date
+    uri = build_mongo_uri(config)
+    storage_config = config.get('storage', {})
+    local = storage_config.get('handoff', 'local') == 'local'
+    publish = storage_config.get('publish_to_mongo', True) or not local
+    model_pipeline_config = config.get('model_pipeline', {})
+    if model_pipeline_config.get('daily_source', 'stored') == 'aggregate':
+        # Group the clean transactions by day where they are stored, only the daily rows are transferred
+        transaction_df = aggregate_daily_series(uri, "Transactions_Database", "Clean_Transactions_Data",
+                                                layout_of(config, "Clean_Transactions_Data"),
+                                                config['paths']['clean_data_file'] if local else None)
+    elif local:
+        transaction_df = load_arrow(config['paths']['daily_data_file'])
+    else:
+        transaction_df = read_clean_data(uri,"Transactions_Database","Daily_Transactions_Data")
     
     if transaction_df is None:
         raise ValueError("Error: Failed to read clean data.")
@@ -24,7 +34,21 @@ def run_model_pipeline(config):
     if cleaned_df is None:
         raise ValueError("Error: Failed to clean data.")
 
-    forecast_and_save(cleaned_df, "Transactions_Database",'transactions_per_day', uri)
-    
-    # Forecast and save 'CTA'
-    forecast_and_save(cleaned_df, "Transactions_Database",'CTA', uri)
+    batch_size = config['mongodb'].get('batch_size', 10_000)
+    targets = ['transactions_per_day', 'CTA'] + list(model_pipeline_config.get('extra_targets') or [])
+    output_paths = {feature: forecast_path(config, feature) for feature in targets} if local else {}
+    # Fitted models are cached on disk, unchanged data skips the fit and appended data refits warm-started
+    cache_dir = config['paths'].get('model_cache_directory') if model_pipeline_config.get('cache', False) else None
+    # Forecasting backend of each target, prophet unless set, and the options of each backend by name
+    backends = model_pipeline_config.get('backends') or {}
+    backend_options = {name: model_pipeline_config.get(name) or {} for name in set(backends.values()) | {'prophet'}}
+
+    if model_pipeline_config.get('parallel', False):
+        # Fit every Prophet target in its own process
+        forecast_and_save_parallel(cleaned_df, "Transactions_Database", targets, uri, batch_size,
+                                   model_pipeline_config.get('max_workers'), output_paths, publish, cache_dir, backend_options, backends)
+    else:
+        for feature in targets:
+            backend = backends.get(feature, 'prophet')
+            forecast_and_save(cleaned_df, "Transactions_Database", feature, uri, batch_size,
+                              output_paths.get(feature), publish, cache_dir, backend_options[backend], backend)
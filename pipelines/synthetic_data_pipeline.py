@@ -1,30 +1,46 @@
 import os
-from urllib.parse import quote_plus
 import yaml
 from zenml import pipeline
-from steps.synthetic_data_steps import generate_transactions, modify_forecasts, read_data,save_transactions_data_to_mongodb
+from database import build_mongo_uri
+from bootstrap import layout_of
+from storage import forecast_path
+from steps.storage_steps import load_forecasts
+from steps.synthetic_data_steps import generate_scenarios, generate_transactions, modify_forecasts, read_forecast_store, save_transactions_data_to_mongodb
 
 @pipeline(enable_cache=False)
 def run_synthetic_data_pipeline(config):
-    username = quote_plus(config['mongodb']['user_name'])
-    password = quote_plus(config['mongodb']['user_password'])
-    uri_start= config['mongodb']['uri_start']
-    uri_end= config['mongodb']['uri_end']
-    uri = uri_start + username + ':' + password +'@'+ uri_end
+    uri = build_mongo_uri(config)
     print(uri)
-    # Read data
-    combined_df = read_data(uri, "Transactions_Database", ["transactions_per_day","CTA"])
+    # Read the forecasts from the model pipeline's local files, or from MongoDB
+    if config.get('storage', {}).get('handoff', 'local') == 'local':
+        combined_df = load_forecasts([forecast_path(config, "transactions_per_day"), forecast_path(config, "CTA")])
+    else:
+        combined_df = read_forecast_store(uri, "Transactions_Database", ["transactions_per_day","CTA"], "Forecasts")
     print(combined_df)
     if combined_df is None:
         raise ValueError("Error: Failed to read data.")
     
+    batch_size = config['mongodb'].get('batch_size', 10_000)
+    workers = config['mongodb'].get('write_workers', 1)
+    seed = config.get('random', {}).get('seed')
+    synthetic_config = config.get('synthetic_data_pipeline', {})
+    scenarios = synthetic_config.get('scenarios')
+    layout = layout_of(config, "synthetic_Transactions")
+
+    if scenarios:
+        # Generate every configured scenario from the same forecasts across a process pool
+        generate_scenarios(combined_df, scenarios, uri, "Transactions_Database", "synthetic_Transactions",
+                           batch_size, workers, synthetic_config.get('max_workers'), seed, layout)
+        return
+
     # Combine and modify forecasts
     combined_df = modify_forecasts(combined_df, 5, 5, 5, 19)
     
     # Generate transactions
-    combined_df = generate_transactions(combined_df)
+    combined_df = generate_transactions(combined_df, seed)
     
     # Save transactions data
     # save_transactions_data(combined_df, output_folder)
 
-    save_transactions_data_to_mongodb(combined_df, uri, "Transactions_Database", "synthetic_Transactions")
+    save_transactions_data_to_mongodb(combined_df, uri, "Transactions_Database", "synthetic_Transactions",
+                                      batch_size, workers, seed, layout)
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+from steps.time_features import TIME_FEATURES
+
+# Largest relative error a float column may pick up when it is stored as float32
+FLOAT32_RTOL = 1e-6
+
+# Column -> dtype rule of the DataFrames handed between steps. Rules:
+#   'datetime'  timezone-naive UTC datetime64[s]
+#   'integer'   smallest signed integer type holding every value
+#   'float32'   float32 when every value survives within FLOAT32_RTOL, float64 otherwise
+#   'category'  pandas categorical
+# Columns without a rule are left as they are.
+
+# The clean transactions of the data pipeline
+TRANSACTIONS = {
+    'timestamp': 'datetime',
+    'amount': 'integer',
+    'CTA': 'float32',
+    'transactions_per_day': 'integer',
+    **{name: 'category' for name in TIME_FEATURES},
+}
+
+# The per-day aggregates the models are fitted on. The means and sums stay float64, they are few rows and
+# feed the models directly
+DAILY = {
+    'timestamp': 'datetime',
+    'transactions_per_day': 'integer',
+}
+
+# The synthetic transactions
+SYNTHETIC_TRANSACTIONS = {
+    'Timestamp': 'datetime',
+    'Amount': 'integer',
+    'scenario': 'category',
+}
+
+
+def _datetime(values: pd.Series) -> pd.Series:
+    if values.dtype == 'datetime64[s]':
+        return values
+    if not pd.api.types.is_datetime64_any_dtype(values):
+        values = pd.to_datetime(values, utc=True)
+    if values.dt.tz is not None:
+        values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+    return values.astype('datetime64[s]')
+
+
+def _integer(values: pd.Series) -> pd.Series:
+    # Nullable integers with missing values keep their mask, pd.to_numeric downcasts both kinds
+    if values.dtype.kind == 'f' or not pd.api.types.is_integer_dtype(values):
+        return values
+    return pd.to_numeric(values, downcast='integer')
+
+
+def _float32(values: pd.Series) -> pd.Series:
+    if values.dtype != np.float64:
+        return values
+    narrow = values.astype(np.float32)
+    if np.allclose(narrow.to_numpy(), values.to_numpy(), rtol=FLOAT32_RTOL, atol=0, equal_nan=True):
+        return narrow
+    return values
+
+
+def _category(values: pd.Series) -> pd.Series:
+    return values if isinstance(values.dtype, pd.CategoricalDtype) else values.astype('category')
+
+
+_RULES = {'datetime': _datetime, 'integer': _integer, 'float32': _float32, 'category': _category}
+
+
+def compact(df: pd.DataFrame, schema: dict) -> pd.DataFrame:
+    '''The function `compact` enforces the compact dtypes of a schema on a DataFrame at a step boundary.
+    Columns already in their compact dtype are not touched, so enforcing the schema again is cheap.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The DataFrame returned by a step. Its columns are replaced in place.
+    schema : dict
+        The column rules, e.g. `TRANSACTIONS`, `DAILY` or `SYNTHETIC_TRANSACTIONS`.
+
+    Returns
+    -------
+        The same DataFrame with every column of the schema in its compact dtype. A `None` or empty frame
+    is returned as it is.
+    '''
+    if df is None or df.empty:
+        return df
+    for column, rule in schema.items():
+        if column not in df.columns:
+            continue
+        values = _RULES[rule](df[column])
+        if values.dtype != df[column].dtype:
+            df[column] = values
+    return df
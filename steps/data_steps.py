@@ -1,8 +1,14 @@
 import json
 import pandas as pd
 import numpy as np
-from pymongo import MongoClient
+from pymongo import UpdateMany, UpdateOne
 from zenml import step,pipeline
+from instrumentation import instrumented
+from steps.time_features import build_time_features
+from database import get_client, write_frame
+from bootstrap import clear_collection, write_collection
+from utils import make_rng
+from schema import DAILY, TRANSACTIONS, compact
 import logging
 import re
 
@@ -15,31 +21,242 @@ console_handler.setLevel(logging.INFO)
 console_handler.setFormatter(formatter)
 logger.addHandler(console_handler)
 
+# Separators that may appear between top-level records: whitespace, commas and the
+# brackets of an enclosing JSON array. NDJSON files only ever contain whitespace.
+_RECORD_SEPARATORS = re.compile(r'[\s,\[\]]*')
+
+def iter_json_records(file_path: str, buffer_size: int = 1 << 20, max_record_size: int = 64 << 20):
+    '''The function `iter_json_records` incrementally parses a JSON array or NDJSON file and yields one
+    record at a time, so the whole file never has to be held in memory.
+    
+    Parameters
+    ----------
+    file_path : str
+        The path to a JSON file containing either a top-level array of records or one record per line.
+    buffer_size : int, optional
+        The number of characters read from the file at a time.
+    max_record_size : int, optional
+        The largest number of characters a single record may span. A malformed record would otherwise
+    make the rest of the file be read into the buffer and parsed again on every read, so a
+    `json.JSONDecodeError` is raised once an unparsable record grows past it.
+    
+    Returns
+    -------
+        A generator yielding each record as a Python dict.
+    
+    '''
+    decoder = json.JSONDecoder()
+    with open(file_path, 'r', encoding='utf-8') as f:
+        buffer = ''
+        pos = 0
+        while True:
+            pos = _RECORD_SEPARATORS.match(buffer, pos).end()
+            if pos >= len(buffer):
+                buffer = f.read(buffer_size)
+                pos = 0
+                if not buffer:
+                    return
+                continue
+            try:
+                record, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if len(buffer) - pos >= max_record_size:
+                    raise
+                # The record is cut off at the end of the buffer, read more and retry. The read grows with the
+                # pending record so a long one is parsed a logarithmic number of times
+                more = f.read(max(buffer_size, len(buffer) - pos))
+                if not more:
+                    raise
+                buffer = buffer[pos:] + more
+                pos = 0
+                continue
+            yield record
+
+def _record_amount(tx):
+    '''Return the raw `amount` value of a transaction held either as a dict or as a JSON string.'''
+    if isinstance(tx, dict):
+        return tx.get('amount')
+    if isinstance(tx, str):
+        return extract_amount(tx)
+    return None
+
+# Upper bound of the epoch values read in each unit, 1e11 seconds is past the year 5000
+_EPOCH_UNITS = [('s', 1e11), ('ms', 1e14), ('us', 1e17)]
+
+def _parse_timestamps(values: pd.Series) -> pd.Series:
+    '''Parse raw timestamps the way `pd.read_json` does, detecting the unit of epoch values from their
+    magnitude: seconds, milliseconds, microseconds or nanoseconds.'''
+    if pd.api.types.is_numeric_dtype(values):
+        magnitude = values.abs().max()
+        unit = next((unit for unit, limit in _EPOCH_UNITS if magnitude < limit), 'ns')
+        return pd.to_datetime(values, unit=unit, utc=True)
+    return pd.to_datetime(values, utc=True)
+
+def _parse_amounts(raw: pd.Series) -> pd.Series:
+    '''Convert raw `amount` values to nullable integers, keeping only digit strings like `extract_amount`.'''
+    if pd.api.types.infer_dtype(raw, skipna=True) not in ('string', 'mixed', 'mixed-integer'):
+        # No strings at all, e.g. a chunk of numeric amounts, which `extract_amount` never matches either
+        return pd.Series(pd.NA, index=raw.index, dtype='Int64')
+    raw = raw.where(raw.str.isdigit().eq(True))
+    return pd.to_numeric(raw, errors='coerce', dtype_backend='numpy_nullable')
+
+def _build_chunk(timestamps: list, amounts: list) -> pd.DataFrame:
+    '''Build one ingestion chunk from the raw timestamps and amounts collected so far.'''
+    return pd.DataFrame({
+        'timestamp': _parse_timestamps(pd.Series(timestamps)),
+        'amount': _parse_amounts(pd.Series(amounts, dtype=object)),
+    })
+
+def iter_json_chunks(file_path: str, chunk_size: int = 100_000):
+    '''The function `iter_json_chunks` streams a raw transactions file and yields bounded-size DataFrames
+    holding only the `timestamp` and `amount` of each record.
+    
+    Parameters
+    ----------
+    file_path : str
+        The path to the raw transactions JSON or NDJSON file.
+    chunk_size : int, optional
+        The maximum number of rows in each yielded DataFrame.
+    
+    Returns
+    -------
+        A generator of DataFrames with a `timestamp` column and a nullable integer `amount` column, where amounts
+    that are missing or not numeric are NaN.
+    
+    '''
+    timestamps = []
+    amounts = []
+    for record in iter_json_records(file_path):
+        timestamps.append(record.get('timestamp'))
+        amounts.append(_record_amount(record.get('tx')))
+        if len(timestamps) >= chunk_size:
+            yield _build_chunk(timestamps, amounts)
+            timestamps = []
+            amounts = []
+    if timestamps:
+        yield _build_chunk(timestamps, amounts)
+
 @step
-def load_json(file_path:str)->pd.DataFrame:
-    '''The function `load_json` reads a JSON file into a pandas DataFrame and converts a specific column to
-    JSON strings.
+@instrumented
+def load_json(file_path:str, streaming: bool = False, chunk_size: int = 100_000, since: str = None)->pd.DataFrame:
+    '''The function `load_json` reads a JSON file into a pandas DataFrame of the `timestamp` and `amount`
+    of each record. Amounts are read from the parsed `tx` dicts with `extract_amounts` inside the step, so
+    the dicts, which Parquet cannot always store, never cross a step boundary.
     
     Parameters
     ----------
     file_path : str
         The `file_path` parameter in the `load_json` function is a string that represents the path to the
     JSON file from which data needs to be loaded into a Pandas DataFrame.
+    streaming : bool, optional
+        When True the file is parsed incrementally in chunks of `chunk_size` records and only the
+    `timestamp` and `amount` of each record are kept. Only the parsing is bounded: the parsed dicts of
+    one chunk are held at a time instead of the whole file's, but the two-column chunks are concatenated
+    into one DataFrame, so memory still grows with the number of records (about 16 bytes each).
+    chunk_size : int, optional
+        The number of records parsed per chunk in streaming mode.
+    since : str, optional
+        An ISO timestamp (the incremental high-water mark). When given, only records strictly newer than
+    it are returned.
     
     Returns
     -------
-        A pandas DataFrame containing the data loaded from the specified JSON file is being returned.
+        A pandas DataFrame with a `timestamp` column and a nullable integer `amount` column, where amounts
+    that are missing or not numeric are NaN.
     
     '''
     logger.info(f"Loading data from {file_path}")
-    df = pd.read_json("Data/Raw_Data/transactions.json")
-    df['tx'] = df['tx'].apply(lambda x: json.dumps(x))
-    return df
+    empty = pd.DataFrame({'timestamp': pd.Series(dtype='datetime64[s]'), 'amount': pd.Series(dtype='Int64')})
+    if streaming:
+        # The downstream steps need every record at once (e.g. the amount statistics of `generate_CTA`)
+        chunks = []
+        for chunk in iter_json_chunks(file_path, chunk_size):
+            if since:
+                chunk = chunk[newer_than(chunk, since)].reset_index(drop=True)
+            chunks.append(chunk)
+        if not chunks:
+            return empty
+        return compact(pd.concat(chunks, ignore_index=True), TRANSACTIONS)
+    df = pd.read_json(file_path)
+    if since and not df.empty:
+        df = df[newer_than(df, since)].reset_index(drop=True)
+    if df.empty:
+        return empty
+    df = pd.DataFrame({'timestamp': df['timestamp'], 'amount': extract_amounts(df['tx'])})
+    return compact(df, TRANSACTIONS)
+
+def newer_than(df: pd.DataFrame, since: str) -> pd.Series:
+    '''The function `newer_than` flags the rows of `df` whose 'timestamp' is strictly after the high-water
+    mark `since`, an ISO timestamp read as UTC when it has no timezone.'''
+    since = pd.Timestamp(since)
+    since = since.tz_localize('UTC') if since.tzinfo is None else since.tz_convert('UTC')
+    return pd.to_datetime(df['timestamp'], utc=True) > since
+
+@step
+@instrumented
+def get_high_water_mark(mongo_uri: str, db_name: str, collection_name: str, state_collection: str = 'Pipeline_State') -> str:
+    '''The function `get_high_water_mark` reads the timestamp of the newest transaction already saved to
+    a collection by an incremental run.
+    
+    Parameters
+    ----------
+    mongo_uri : str
+        The URI string for connecting to the MongoDB server.
+    db_name : str
+        The name of the MongoDB database.
+    collection_name : str
+        The name of the collection the high-water mark belongs to.
+    state_collection : str, optional
+        The collection holding one state document per tracked collection.
+    
+    Returns
+    -------
+        The high-water mark as an ISO formatted UTC timestamp, or an empty string if no incremental run
+    has been saved yet, in which case the whole raw file is processed.
+    
+    '''
+    try:
+        client = get_client(mongo_uri)
+        state = client[db_name][state_collection].find_one({'_id': collection_name})
+        if state is None or state.get('high_water_mark') is None:
+            return ''
+        return pd.Timestamp(state['high_water_mark']).isoformat()
+    except Exception as e:
+        print(f"An error occurred while reading the high-water mark: {e}")
+        return ''
+
+@step
+@instrumented
+def oldest_high_water_mark(local_mark: str = None, mongo_mark: str = None) -> str:
+    '''The function `oldest_high_water_mark` picks the high-water mark the raw file is loaded from when the
+    local store and MongoDB are both updated incrementally. Each store keeps its own mark and skips the
+    rows it already holds, so a store whose last update failed catches up on the next run.
+
+    Parameters
+    ----------
+    local_mark : str, optional
+        The mark of the local Parquet dataset, None when it is not updated.
+    mongo_mark : str, optional
+        The mark of the MongoDB collection, None when it is not updated.
+
+    Returns
+    -------
+        The older of the marks in use, or an empty string when a store has none yet and the whole raw
+    file has to be processed.
+
+    '''
+    marks = [mark for mark in (local_mark, mongo_mark) if mark is not None]
+    if not marks or '' in marks:
+        return ''
+    return min(marks, key=lambda mark: pd.to_datetime(mark, utc=True))
 
 @step
-def save_to_mongoDB(df: pd.DataFrame, mongo_uri: str, db_name: str, collection_name: str)-> None:
+@instrumented
+def save_to_mongoDB(df: pd.DataFrame, mongo_uri: str, db_name: str, collection_name: str, batch_size: int = 10_000, workers: int = 1, layout: str = 'plain')-> None:
+    '''The function `save_to_mongoDB` replaces the documents of a collection with the rows of a DataFrame,
+    in the collection layout from `bootstrap.LAYOUTS` ('plain', 'timeseries' or 'monthly').'''
 
-    client = MongoClient(mongo_uri)
+    client = get_client(mongo_uri)
     # Send a ping to confirm a successful connection
     try:
         client.admin.command('ping')
@@ -56,22 +273,113 @@ def save_to_mongoDB(df: pd.DataFrame, mongo_uri: str, db_name: str, collection_n
     if collection_name not in db.list_collection_names():
         print(f"Collection '{collection_name}' does not exist. It will be created when data is inserted.")
 
-    collection = db[collection_name]
     try:
-        result = collection.delete_many({})
-        print(f"Deleted {result.deleted_count} documents from collection '{collection_name}'")
+        deleted = clear_collection(db, collection_name, layout)
+        print(f"Deleted {deleted} documents from collection '{collection_name}'")
     except Exception as e:
         print(f"An error occurred while deleting previous data: {e}")
         return  # Exit if deletion fails
     
     try:
-        records = df.to_dict(orient='records')
-        collection.insert_many(records)
+        write_collection(db, collection_name, df, layout, batch_size, workers)
         print(f"Data saved to MongoDB")
     except Exception as e:
         print(f"An error occurred while saving data to MongoDB: {e}")
 
+@step
+@instrumented
+def upsert_to_mongoDB(df: pd.DataFrame, mongo_uri: str, db_name: str, collection_name: str, since: str = '', state_collection: str = 'Pipeline_State', batch_size: int = 10_000, workers: int = 1, daily_collection: str = None) -> None:
+    '''The function `upsert_to_mongoDB` is the incremental counterpart of `save_to_mongoDB`. It writes only
+    the new transactions, recomputes `transactions_per_day` for the days they touch and advances the
+    high-water mark.
+    
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The new transactions with their features. Rows not newer than `since` are already stored and
+    skipped, `df` may have been loaded from the older high-water mark of the local store.
+    mongo_uri : str
+        The URI string for connecting to the MongoDB server.
+    db_name : str
+        The name of the MongoDB database.
+    collection_name : str
+        The name of the collection holding the clean transactions.
+    since : str, optional
+        The high-water mark `df` was loaded from, as returned by `get_high_water_mark`.
+    state_collection : str, optional
+        The collection holding the high-water mark documents.
+    batch_size : int, optional
+        The number of documents per insert batch.
+    workers : int, optional
+        The number of threads sending insert batches concurrently.
+    daily_collection : str, optional
+        The collection holding the `aggregate_daily` rows, whose affected days are upserted.
+    
+    '''
+    if since:
+        df = df[newer_than(df, since)]
+    if df.empty:
+        print(f"No new transactions to save to '{collection_name}'")
+        return
 
+    client = get_client(mongo_uri)
+    db = client[db_name]
+    collection = db[collection_name]
+
+    try:
+        # Documents past the high-water mark can only be left over from a run that failed before
+        # advancing it, replacing them makes re-running over the same records a no-op
+        tail = {'timestamp': {'$gt': pd.Timestamp(since).to_pydatetime()}} if since else {}
+        result = collection.delete_many(tail)
+        if result.deleted_count:
+            print(f"Deleted {result.deleted_count} documents left over from an unfinished run")
+        write_frame(collection, df, batch_size, workers)
+    except Exception as e:
+        print(f"An error occurred while saving new data to MongoDB: {e}")
+        return  # Keep the old high-water mark so the records are retried
+
+    try:
+        # Recount the full days touched by the new records, older days keep their stored counts
+        timestamps = pd.to_datetime(df['timestamp'], utc=True).dt.tz_localize(None)
+        first_day = timestamps.min().normalize()
+        last_day = timestamps.max().normalize() + pd.Timedelta(days=1)
+        days = collection.aggregate([
+            {'$match': {'timestamp': {'$gte': first_day.to_pydatetime(), '$lt': last_day.to_pydatetime()}}},
+            {'$group': {
+                '_id': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$timestamp'}},
+                'transactions_per_day': {'$sum': 1},
+                'amount_sum': {'$sum': '$amount'},
+                'amount': {'$avg': '$amount'},
+                'CTA_sum': {'$sum': '$CTA'},
+                'CTA': {'$avg': '$CTA'},
+            }},
+        ])
+        affected_days = set(timestamps.dt.strftime('%Y-%m-%d'))
+        updates = []
+        daily_updates = []
+        for day in days:
+            if day['_id'] not in affected_days:
+                continue
+            start = pd.Timestamp(day['_id']).to_pydatetime()
+            end = (pd.Timestamp(day['_id']) + pd.Timedelta(days=1)).to_pydatetime()
+            updates.append(UpdateMany({'timestamp': {'$gte': start, '$lt': end}}, {'$set': {'transactions_per_day': day['transactions_per_day']}}))
+            aggregates = {key: value for key, value in day.items() if key != '_id'}
+            daily_updates.append(UpdateOne({'timestamp': start}, {'$set': aggregates}, upsert=True))
+        if updates:
+            collection.bulk_write(updates, ordered=False)
+        if daily_updates and daily_collection:
+            db[daily_collection].bulk_write(daily_updates, ordered=False)
+        print(f"Recomputed transactions_per_day for {len(updates)} days")
+    except Exception as e:
+        print(f"An error occurred while recomputing transactions per day: {e}")
+        return
+
+    db[state_collection].update_one({'_id': collection_name},
+                                    {'$set': {'high_water_mark': timestamps.max().to_pydatetime()}},
+                                    upsert=True)
+    print(f"High-water mark for '{collection_name}' advanced to {timestamps.max()}")
+
+_AMOUNT_PATTERN = re.compile(r'"amount": "(\d+)"')
 
 def extract_amount(tx: str) -> int:
     '''The function `extract_amount` extracts and returns the amount value from a transaction string in
@@ -91,13 +399,35 @@ def extract_amount(tx: str) -> int:
     the extracted amount as an integer. If no match is found, it returns `None`.
     
     '''
-    match = re.search(r'"amount": "(\d+)"', tx)
+    match = _AMOUNT_PATTERN.search(tx)
     if match:
         return int(match.group(1))
     else:
         return None
 
+def extract_amounts(tx: pd.Series) -> pd.Series:
+    '''The function `extract_amounts` is the columnar counterpart of `extract_amount`, reading the amount
+    of every transaction in a column in one vectorized pass.
+    
+    Parameters
+    ----------
+    tx : pd.Series
+        A Series of parsed transaction dicts as read from the raw file, or of transaction JSON strings.
+    
+    Returns
+    -------
+        A nullable integer Series with the amount of each transaction, or `<NA>` wherever
+    `extract_amount` would have returned `None`.
+    
+    '''
+    if pd.api.types.infer_dtype(tx, skipna=True) == 'string':
+        raw = tx.str.extract(_AMOUNT_PATTERN, expand=False)
+    else:
+        raw = tx.str.get('amount')
+    return _parse_amounts(raw)
+
 @step
+@instrumented
 def remove_columns(df: pd.DataFrame, columns_to_keep: list[str]) -> pd.DataFrame:
     '''This function removes specified columns from a DataFrame, extracts amounts from a 'tx' column, fills
     missing values with the mode, converts amounts to integers, and then drops the 'tx' column before
@@ -118,13 +448,20 @@ def remove_columns(df: pd.DataFrame, columns_to_keep: list[str]) -> pd.DataFrame
     
     '''
     try:
-        df = df[columns_to_keep]
-        amounts = df['tx'].apply(extract_amount)
-        amounts = amounts.fillna(amounts.mode()[0])
-        amounts = amounts.astype(int)
-        df.loc[:, 'amount'] = amounts
-        df.drop(columns='tx',inplace=True)
-        return df
+        missing = [column for column in columns_to_keep if column not in df.columns]
+        if missing:
+            raise KeyError(f"{missing} not in the DataFrame")
+        if 'tx' in columns_to_keep:
+            amounts = extract_amounts(df['tx'])
+        else:
+            # `load_json` already pulled the amount out of each record
+            amounts = df['amount']
+        if amounts.isna().any():
+            amounts = amounts.fillna(amounts.mode()[0])
+        # Build the result once from the kept columns instead of copying a slice and assigning into it
+        columns = {column: df[column] for column in columns_to_keep if column not in ('tx', 'amount')}
+        columns['amount'] = amounts.to_numpy(dtype=np.int64)
+        return compact(pd.DataFrame(columns), TRANSACTIONS)
     except KeyError as e:
         logger.error(f"KeyError: {e}")
         return None
@@ -133,7 +470,8 @@ def remove_columns(df: pd.DataFrame, columns_to_keep: list[str]) -> pd.DataFrame
         return None
 
 @step
-def add_time_features(df:pd.DataFrame)->pd.DataFrame:
+@instrumented
+def add_time_features(df:pd.DataFrame, features: list[str] = None, options: dict = None)->pd.DataFrame:
     '''This function adds time-related features such as day/night, weekend, and season based on the
     timestamp column in a DataFrame.
     
@@ -143,26 +481,32 @@ def add_time_features(df:pd.DataFrame)->pd.DataFrame:
         The function `add_time_features` takes a pandas DataFrame `df` as input and adds several
     time-related features to it. These features include 'day_night' to determine if it's day or night
     based on the hour of the timestamp, 'weekend' to indicate if it's a weekend
+    features : list[str], optional
+        The names of the features from `steps.time_features.TIME_FEATURES` to add. Defaults to
+    'day_night', 'weekend' and 'season'.
+    options : dict, optional
+        Options for the feature functions, e.g. `holiday_country` for the 'holiday' feature.
     
     Returns
     -------
-        The function `add_time_features` is returning a pandas DataFrame with additional columns for
-    day_night, weekend, and season based on the timestamp column in the input DataFrame. If an error
-    occurs during the process, it will print an error message and return None.
+        The function `add_time_features` is returning a pandas DataFrame with additional categorical
+    columns for day_night, weekend, and season (or the requested features) based on the timestamp column
+    in the input DataFrame. If an error occurs during the process, it will print an error message and
+    return None.
     
     '''
     try:
         df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df['day_night'] = df['timestamp'].dt.hour.apply(lambda x: 'day' if 6 <= x < 18 else 'night')
-        df['weekend'] = df['timestamp'].dt.weekday.apply(lambda x: 'yes' if x >= 5 else 'no')
-        df['season'] = df['timestamp'].dt.month.apply(lambda x: 'Spring' if 3 <= x <= 5 else ('Summer' if 6 <= x <= 8 else ('Autumn' if 9 <= x <= 11 else 'Winter')))
-        return df
+        time_features = build_time_features(df['timestamp'], features, options)
+        df[time_features.columns] = time_features
+        return compact(df, TRANSACTIONS)
     except Exception as e:
         print(f"An error occurred while adding time features: {e}")
         return None
 
 @step
-def generate_CTA(df:pd.DataFrame)->pd.DataFrame:
+@instrumented
+def generate_CTA(df:pd.DataFrame, seed:int = None)->pd.DataFrame:
     '''The function `generate_CTA` calculates the mean and standard deviation of non-zero amounts in a
     DataFrame, generates random amounts for zero values, and creates a new column 'CTA' with normalized
     amounts.
@@ -173,6 +517,8 @@ def generate_CTA(df:pd.DataFrame)->pd.DataFrame:
         It seems like you have not provided the DataFrame `df` that is required as input for the
     `generate_CTA` function. Please provide the DataFrame `df` so that I can assist you further with
     generating the CTA column based on the given logic in the function.
+    seed : int, optional
+        The configured random seed, the random amounts are drawn from its 'generate_CTA' stream.
     
     Returns
     -------
@@ -186,15 +532,20 @@ def generate_CTA(df:pd.DataFrame)->pd.DataFrame:
         non_zero_amount_std = df.loc[df['amount'] > 10, 'amount'].std()
         zero_amount_indices = df['amount'] <= 10
         num_zero_values = zero_amount_indices.sum()
-        random_amounts = np.abs(np.random.normal(non_zero_amount_mean, non_zero_amount_std, num_zero_values))
-        df.loc[zero_amount_indices, 'amount'] = (random_amounts/10e6).astype(int)
-        df['CTA'] = df['amount'] / 10e6
-        return df
+        rng = make_rng(seed, 'generate_CTA')
+        random_amounts = np.abs(rng.normal(non_zero_amount_mean, non_zero_amount_std, num_zero_values))
+        # Replaced as a whole, the random amounts may not fit the compact dtype of the column
+        amounts = df['amount'].to_numpy(dtype=np.int64, copy=True)
+        amounts[zero_amount_indices.to_numpy()] = (random_amounts/10e6).astype(np.int64)
+        df['amount'] = amounts
+        df['CTA'] = amounts / 10e6
+        return compact(df, TRANSACTIONS)
     except Exception as e:
         print(f"An error occurred while generating CTA column: {e}")
         return None
 
 @step
+@instrumented
 def calculate_transactions_per_day(df:pd.DataFrame)->pd.DataFrame:
     '''The function calculates the number of transactions per day based on a timestamp column in a
     DataFrame.
@@ -216,13 +567,53 @@ def calculate_transactions_per_day(df:pd.DataFrame)->pd.DataFrame:
     '''
     try:
         df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df['date'] = df['timestamp'].dt.date
-        df['transactions_per_day'] = df.groupby('date')['timestamp'].transform('count')
-        df.drop(columns=['date'], inplace=True)
-        return df
+        # Group on the floored timestamps rather than a temporary column of Python dates
+        df['transactions_per_day'] = df.groupby(df['timestamp'].dt.floor('D'))['timestamp'].transform('count')
+        return compact(df, TRANSACTIONS)
     except Exception as e:
         print(f"An error occurred while calculating transactions per day: {e}")
         return None
 
+def daily_aggregates(df: pd.DataFrame) -> pd.DataFrame:
+    '''Collapse transactions with 'timestamp', 'amount' and 'CTA' columns to the per-day rows described
+    in `aggregate_daily`.'''
+    days = pd.to_datetime(df['timestamp']).dt.floor('D')
+    if days.dt.tz is not None:
+        days = days.dt.tz_convert('UTC').dt.tz_localize(None)
+    # Summed in float64, the per-transaction 'CTA' may be float32
+    daily = df.assign(amount=df['amount'].astype(float), CTA=df['CTA'].astype(float)).groupby(days.rename('timestamp')).agg(
+        transactions_per_day=('amount', 'size'),
+        amount_sum=('amount', 'sum'),
+        amount=('amount', 'mean'),
+        CTA_sum=('CTA', 'sum'),
+        CTA=('CTA', 'mean'),
+    )
+    return compact(daily.reset_index(), DAILY)
+
+@step
+@instrumented
+def aggregate_daily(df:pd.DataFrame)->pd.DataFrame:
+    '''The function `aggregate_daily` collapses the transactions to one row per day, which is the compact
+    series the forecasting models are fitted on.
+    
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The transactions with 'timestamp', 'amount' and 'CTA' columns.
+    
+    Returns
+    -------
+        A DataFrame with one row per date holding the day's 'timestamp' (midnight, UTC without timezone),
+    'transactions_per_day' count, the 'amount_sum' and 'CTA_sum' totals, and the per-transaction means
+    'amount' and 'CTA'. The means keep the level a model fitted on the per-transaction rows would see. If
+    an error occurs, it will print an error message and return None.
+    
+    '''
+    try:
+        return daily_aggregates(df)
+    except Exception as e:
+        print(f"An error occurred while aggregating transactions per day: {e}")
+        return None
+
 if __name__=='__main__':
     pass
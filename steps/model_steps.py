@@ -1,12 +1,21 @@
+import os
+from concurrent.futures import as_completed
 import pandas as pd
 import numpy as np
-from prophet import Prophet
 from zenml import pipeline, step
-from utils import days
+from instrumentation import instrumented
+from utils import days, process_pool
 import pandas as pd
-from pymongo import MongoClient
+from pymongo import UpdateOne
+from database import get_client, iter_frames
+from storage import write_arrow
+from schema import DAILY, compact
+from aggregation import MongoDailyAggregator, ParquetDailyAggregator
+from model_cache import ModelCache
+from forecasters import DEFAULT_FORECASTER, fit_prophet, get_forecaster, predict_prophet
 
 @step
+@instrumented
 def read_clean_data(mongo_uri: str, db_name: str, collection_name: str) -> pd.DataFrame:
     '''The function `read_clean_data` reads data from a MongoDB collection into a pandas DataFrame,
     handling exceptions for connection errors and other issues.
@@ -26,24 +35,58 @@ def read_clean_data(mongo_uri: str, db_name: str, collection_name: str) -> pd.Da
         If an error occurs during the process, an empty DataFrame is returned.
     '''
     try:
-        client = MongoClient(mongo_uri)
+        client = get_client(mongo_uri)
         db = client[db_name]
         collection = db[collection_name]
         
-        # Fetch data from MongoDB collection
-        cursor = collection.find()
-        df = pd.DataFrame(list(cursor))
-        
-        # If 'timestamp' is a field, parse it as dates
-        if 'timestamp' in df.columns:
-            df['timestamp'] = pd.to_datetime(df['timestamp'])
-        df=df.drop(columns='_id')
-        return df
+        # Fetch data from MongoDB collection, without '_id', one chunk at a time. 'timestamp' is parsed to
+        # timezone-naive UTC dates per chunk, so the uncompacted rows never exist all at once
+        frames = [compact(chunk, DAILY) for chunk in iter_frames(collection)]
+        if not frames:
+            return pd.DataFrame()
+        return compact(pd.concat(frames, ignore_index=True), DAILY)
     except Exception as e:
         print(f"An error occurred while reading data from MongoDB: {e}")
         return pd.DataFrame()
 
 @step
+@instrumented
+def aggregate_daily_series(mongo_uri: str, db_name: str, collection_name: str, layout: str = 'plain', clean_path: str = None) -> pd.DataFrame:
+    '''The function `aggregate_daily_series` computes the per-day series the models are fitted on from the
+    clean transactions where they are stored, instead of reading the transactions into pandas. MongoDB
+    groups them by day server-side, or the local Parquet dataset is scanned batch by batch, so transfer
+    and memory scale with the number of days.
+
+    Parameters
+    ----------
+    mongo_uri : str
+        The URI string for connecting to the MongoDB server.
+    db_name : str
+        The name of the MongoDB database.
+    collection_name : str
+        The collection of the clean transactions.
+    layout : str, optional
+        The layout of the collection, see `bootstrap.LAYOUTS`.
+    clean_path : str, optional
+        The Parquet dataset of the clean transactions. When given it is aggregated instead of MongoDB.
+
+    Returns
+    -------
+        One row per day with the columns of `aggregation.DAILY_COLUMNS`, the same as `aggregate_daily`
+    returns. If an error occurs, it will print an error message and return an empty DataFrame.
+    '''
+    try:
+        if clean_path:
+            aggregator = ParquetDailyAggregator(clean_path)
+        else:
+            aggregator = MongoDailyAggregator(get_client(mongo_uri)[db_name], collection_name, layout)
+        return aggregator.daily()
+    except Exception as e:
+        print(f"An error occurred while aggregating the daily series: {e}")
+        return pd.DataFrame()
+
+@step
+@instrumented
 def clean_data(df:pd.DataFrame)->pd.DataFrame:
     '''The function `clean_data` renames a column in a DataFrame to 'ds' and removes timezone information
     from the 'ds' column.
@@ -64,7 +107,8 @@ def clean_data(df:pd.DataFrame)->pd.DataFrame:
     '''
     try:
         df = df.rename(columns={'timestamp': 'ds'})
-        df['ds'] = df['ds'].dt.tz_localize(None)
+        if df['ds'].dt.tz is not None:
+            df['ds'] = df['ds'].dt.tz_localize(None)
         return df
     except KeyError as e:
         print(f"KeyError: {e}")
@@ -73,10 +117,115 @@ def clean_data(df:pd.DataFrame)->pd.DataFrame:
         print(f"An error occurred while cleaning the data: {e}")
         return pd.DataFrame
 
+def fit_forecast(df: pd.DataFrame, feature: str, periods: int = days, cache_dir: str = None, hyperparams: dict = None,
+                 backend: str = DEFAULT_FORECASTER) -> pd.DataFrame:
+    '''The function `fit_forecast` fits a forecasting model on one feature and returns its forecast for the
+    next `periods` days. It has no side effects apart from the model cache, so it can run in a worker
+    process.
+    
+    Parameters
+    ----------
+    df : pd.DataFrame
+        A pandas DataFrame with a 'ds' column and the `feature` column.
+    feature : str
+        The column to forecast. 'transactions_per_day' is rounded up to positive counts and 'CTA' is
+    scaled down by 10e6 to whole units, any other feature is returned as predicted.
+    periods : int, optional
+        The number of days to forecast.
+    cache_dir : str, optional
+        The `ModelCache` directory of the Prophet backend. When the training rows are unchanged since the
+    cached fit its forecast is returned without fitting, when rows were only appended the model is
+    refitted starting from the cached parameters. No cache is used when not given.
+    hyperparams : dict, optional
+        Options of the backend, the keyword arguments of the `Prophet` model for 'prophet'.
+    backend : str, optional
+        The name of a backend registered in `forecasters.FORECASTERS`.
+    
+    Returns
+    -------
+        A DataFrame with the 'timestamp' and '<feature>_forecast' columns of the forecast days.
+    
+    '''
+    subdf = df[['ds', feature]].rename(columns={feature: 'y'}).sort_values('ds', ignore_index=True)
+    hyperparams = hyperparams or {}
+    if backend != 'prophet':
+        forecast = get_forecaster(backend)(subdf, periods, hyperparams)
+        return _forecast_records(forecast, feature)
+
+    cache = ModelCache(cache_dir) if cache_dir else None
+    init = None
+    if cache is not None:
+        status, cached = cache.lookup(feature, hyperparams, subdf, periods)
+        if status == 'hit':
+            print(f"Training data for '{feature}' is unchanged, reusing the cached forecast")
+            return cached
+        if status == 'warm':
+            init = cached
+
+    try:
+        m = fit_prophet(subdf, hyperparams, init)
+    except Exception as e:
+        if init is None:
+            raise
+        # e.g. a seasonality switched on by the longer history changes the parameter shapes
+        print(f"Warm start for '{feature}' failed, fitting from scratch: {e}")
+        m = fit_prophet(subdf, hyperparams)
+    records = _forecast_records(predict_prophet(m, periods), feature)
+    if cache is not None:
+        cache.store(feature, hyperparams, subdf, periods, m, records)
+    return records
+
+def _forecast_records(forecast: pd.DataFrame, feature: str) -> pd.DataFrame:
+    '''Round the 'yhat' forecast of a feature to the units it is stored in and name its columns.'''
+    if feature == 'transactions_per_day':
+        forecast['yhat'] = forecast['yhat'].apply(np.ceil)
+        forecast.loc[forecast['yhat'] < 0, 'yhat'] = np.abs(forecast.loc[forecast['yhat'] < 0, 'yhat'])
+    elif feature == 'CTA':
+        forecast['yhat'] = (forecast['yhat'] / 10e6).astype(int)
+
+    return forecast[['ds', 'yhat']].rename(columns={'ds': 'timestamp', 'yhat': feature+'_forecast'})
+
+# Collection holding one document per forecast day with the '<feature>_forecast' field of every target
+FORECAST_COLLECTION = 'Forecasts'
+
+def save_forecast(records: pd.DataFrame, db_name: str, feature: str, mongo_uri: str, batch_size: int = 10_000,
+                  collection_name: str = FORECAST_COLLECTION) -> None:
+    '''The function `save_forecast` upserts the forecast of a feature into the forecast store, setting its
+    '<feature>_forecast' field on the document of each day. Days outside the new horizon are left over
+    from earlier runs and are removed.'''
+    client = get_client(mongo_uri)
+    db = client[db_name]
+    collection = db[collection_name]
+    collection.create_index('timestamp', unique=True)
+    column = feature + '_forecast'
+    timestamps = pd.to_datetime(records['timestamp']).tolist()
+    values = records[column].tolist()
+    for start in range(0, len(records), batch_size):
+        collection.bulk_write([UpdateOne({'timestamp': timestamp}, {'$set': {column: value}}, upsert=True)
+                               for timestamp, value in zip(timestamps[start:start + batch_size], values[start:start + batch_size])],
+                              ordered=False)
+    if timestamps:
+        result = collection.delete_many({'$or': [{'timestamp': {'$lt': min(timestamps)}}, {'timestamp': {'$gt': max(timestamps)}}]})
+        print(f"Deleted {result.deleted_count} stale documents from collection '{collection_name}'")
+    print(f"Forecasted data for '{feature}' saved to MongoDB")
+
+def store_forecast(records: pd.DataFrame, db_name: str, feature: str, mongo_uri: str, batch_size: int = 10_000,
+                   output_path: str = None, publish: bool = True) -> None:
+    '''The function `store_forecast` writes the forecast of a feature to its local Arrow file and, when
+    `publish` is set, to its MongoDB collection.'''
+    if output_path:
+        write_arrow(records, output_path)
+        print(f"Forecasted data for '{feature}' saved to '{output_path}'")
+    if publish:
+        save_forecast(records, db_name, feature, mongo_uri, batch_size)
+
 @step
-def forecast_and_save(df:pd.DataFrame, db_name:str,feature:str, mongo_uri:str)->None:
-    '''The function `forecast_and_save` uses Facebook Prophet to forecast a specified feature in a
-    DataFrame and saves the forecasted values to a MongoDB collection.
+@instrumented
+def forecast_and_save(df:pd.DataFrame, db_name:str,feature:str, mongo_uri:str, batch_size:int = 10_000,
+                      output_path:str = None, publish:bool = True, cache_dir:str = None, hyperparams:dict = None,
+                      backend:str = DEFAULT_FORECASTER)->None:
+    '''The function `forecast_and_save` uses Facebook Prophet, or another registered backend, to forecast
+    a specified feature in a DataFrame and saves the forecasted values to a local Arrow file and the MongoDB forecast store.
     
     Parameters
     ----------
@@ -88,38 +237,83 @@ def forecast_and_save(df:pd.DataFrame, db_name:str,feature:str, mongo_uri:str)->
         'revenue', 'temperature', 'demand', etc. The function will use this feature to generate a
     mongo_uri : str
         The URI string for connecting to the MongoDB server.
+    batch_size : int, optional
+        The number of forecast documents per insert batch.
+    output_path : str, optional
+        The Arrow file the synthetic data pipeline reads the forecast from, not written when not given.
+    publish : bool, optional
+        Whether to also write the forecast to the `Forecasts` collection.
+    cache_dir : str, optional
+        The model cache directory passed to `fit_forecast`.
+    hyperparams : dict, optional
+        Options of the backend, the keyword arguments of the `Prophet` model for 'prophet'.
+    backend : str, optional
+        The name of a backend registered in `forecasters.FORECASTERS`.
     
     '''
     try:
-        subdf = df[['ds', feature]].rename(columns={feature: 'y'})
-        m = Prophet()
-        m.fit(subdf)
-        future = m.make_future_dataframe(periods=days, freq='D')
-        forecast = m.predict(future)
-
-        if feature == 'transactions_per_day':
-            forecast['yhat'] = forecast['yhat'].apply(np.ceil)
-            forecast.loc[forecast['yhat'] < 0, 'yhat'] = np.abs(forecast.loc[forecast['yhat'] < 0, 'yhat'])
-        elif feature == 'CTA':
-            forecast['yhat'] = (forecast['yhat'] / 10e6).astype(int)
-
-        # Save forecasted data to MongoDB
-        client = MongoClient(mongo_uri)
-        db = client[db_name]
-        collection = db[feature]
-        try:
-            result = collection.delete_many({})
-            print(f"Deleted {result.deleted_count} documents from collection '{feature}'")
-        except Exception as e:
-            print(f"An error occurred while deleting previous data: {e}")
-            return  # Exit if deletion fails
-        records = forecast[['ds', 'yhat']].tail(days).rename(columns={'ds': 'timestamp', 'yhat': feature+'_forecast'}).to_dict(orient='records')
-        collection.insert_many(records)
-        print(f"Forecasted data for '{feature}' saved to MongoDB")
+        records = fit_forecast(df, feature, days, cache_dir, hyperparams, backend)
+        store_forecast(records, db_name, feature, mongo_uri, batch_size, output_path, publish)
     except Exception as e:
         print(f"An error occurred while forecasting and saving data for '{feature}': {e}")
 
-
+@step
+@instrumented
+def forecast_and_save_parallel(df:pd.DataFrame, db_name:str, features:list[str], mongo_uri:str, batch_size:int = 10_000, max_workers:int = None,
+                               output_paths:dict = None, publish:bool = True, cache_dir:str = None, backend_options:dict = None,
+                               backends:dict = None)->None:
+    '''The function `forecast_and_save_parallel` fits one Prophet model per feature in separate processes
+    and saves each forecast on its own, so the wall time is close to that of the slowest single fit.
+    Features using a lightweight backend are forecast in the calling process while the Prophet fits run.
+    
+    Parameters
+    ----------
+    df : pd.DataFrame
+        A pandas DataFrame containing the data for forecasting.
+    db_name : str
+        The name of the MongoDB database.
+    features : list[str]
+        The columns of `df` to forecast, each one is written to its own field of the `Forecasts` collection.
+    mongo_uri : str
+        The URI string for connecting to the MongoDB server.
+    batch_size : int, optional
+        The number of forecast documents per insert batch.
+    max_workers : int, optional
+        The number of worker processes, one per feature (up to the CPU count) when not given.
+    output_paths : dict, optional
+        The Arrow file of each feature, features without one are not written locally.
+    publish : bool, optional
+        Whether to also write the forecasts to the `Forecasts` collection.
+    cache_dir : str, optional
+        The model cache directory passed to `fit_forecast`, each feature has its own entries.
+    backend_options : dict, optional
+        The options of each backend by name, the keyword arguments of the `Prophet` models under 'prophet'.
+    backends : dict, optional
+        The backend of each feature, `DEFAULT_FORECASTER` for features without one.
+    
+    '''
+    output_paths = output_paths or {}
+    backend_options = backend_options or {}
+    backends = {feature: (backends or {}).get(feature, DEFAULT_FORECASTER) for feature in features}
+    prophet_features = [feature for feature in features if backends[feature] == 'prophet']
+    max_workers = max_workers or min(max(len(prophet_features), 1), os.cpu_count() or 1)
+    with process_pool(max_workers) as executor:
+        futures = {executor.submit(fit_forecast, df, feature, days, cache_dir, backend_options.get('prophet'), 'prophet'): feature
+                   for feature in prophet_features}
+        for feature in features:
+            if backends[feature] == 'prophet':
+                continue
+            try:
+                records = fit_forecast(df, feature, days, cache_dir, backend_options.get(backends[feature]), backends[feature])
+                store_forecast(records, db_name, feature, mongo_uri, batch_size, output_paths.get(feature), publish)
+            except Exception as e:
+                print(f"An error occurred while forecasting and saving data for '{feature}': {e}")
+        for future in as_completed(futures):
+            feature = futures[future]
+            try:
+                store_forecast(future.result(), db_name, feature, mongo_uri, batch_size, output_paths.get(feature), publish)
+            except Exception as e:
+                print(f"An error occurred while forecasting and saving data for '{feature}': {e}")
 
 if __name__ == "__main__":
     pass
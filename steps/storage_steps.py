@@ -0,0 +1,169 @@
+import os
+import shutil
+import pandas as pd
+from zenml import step
+from instrumentation import instrumented
+from storage import read_arrow, read_high_water_mark, read_parquet, write_arrow, write_high_water_mark, write_parquet
+from schema import DAILY, TRANSACTIONS, compact
+from steps.data_steps import daily_aggregates, newer_than
+
+def _with_month(df: pd.DataFrame) -> pd.DataFrame:
+    '''Add the integer 'month' (YYYYMM) partition column derived from 'timestamp'.'''
+    timestamps = pd.to_datetime(df['timestamp'])
+    return df.assign(month=timestamps.dt.year * 100 + timestamps.dt.month)
+
+@step
+@instrumented
+def save_clean_data(df: pd.DataFrame, clean_path: str, daily_path: str) -> None:
+    '''The function `save_clean_data` replaces the local store of the data pipeline: the transactions as
+    a Parquet dataset partitioned by month and their per-day aggregates as an Arrow file, the handoff
+    read by the model pipeline.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The clean transactions with 'timestamp', 'amount' and 'CTA' columns.
+    clean_path : str
+        The Parquet dataset directory of the transactions.
+    daily_path : str
+        The Arrow file of the per-day aggregates.
+
+    '''
+    try:
+        # Months missing from `df` and the high-water mark of earlier incremental runs go as well
+        shutil.rmtree(clean_path, ignore_errors=True)
+        write_parquet(_with_month(df), clean_path, partition_cols=['month'])
+        write_arrow(daily_aggregates(df), daily_path)
+        print(f"Saved {len(df)} transactions to '{clean_path}' and their daily aggregates to '{daily_path}'")
+    except Exception as e:
+        print(f"An error occurred while saving the clean data: {e}")
+
+@step
+@instrumented
+def get_local_high_water_mark(clean_path: str) -> str:
+    '''The function `get_local_high_water_mark` reads the timestamp of the newest transaction already
+    appended to the local Parquet dataset by an incremental run.
+
+    Returns
+    -------
+        The high-water mark as an ISO formatted UTC timestamp, or an empty string if nothing has been
+    appended yet, in which case the whole raw file is processed.
+
+    '''
+    try:
+        return read_high_water_mark(clean_path)
+    except Exception as e:
+        print(f"An error occurred while reading the local high-water mark: {e}")
+        return ''
+
+@step
+@instrumented
+def append_clean_data(df: pd.DataFrame, clean_path: str, daily_path: str, since: str = '') -> None:
+    '''The function `append_clean_data` is the incremental counterpart of `save_clean_data`. Every month
+    partition the new transactions fall in is rewritten with its stored rows and the new ones, so the
+    per-row 'transactions_per_day' of a day split across runs is recounted as `upsert_to_mongoDB` does.
+    The days of those months are replaced in the Arrow file and the high-water mark is advanced last.
+
+    Stored rows newer than `since` can only be left over from a run that failed before advancing the
+    high-water mark. They are dropped, so a retried run does not count its rows twice.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The new transactions. Rows not newer than `since` are already stored and skipped, `df` may have
+    been loaded from the older high-water mark of MongoDB.
+    clean_path : str
+        The Parquet dataset directory of the transactions.
+    daily_path : str
+        The Arrow file of the per-day aggregates.
+    since : str, optional
+        The high-water mark returned by `get_local_high_water_mark`. Without one nothing has been
+    appended yet and the rewritten months hold the new transactions only.
+
+    '''
+    try:
+        if since:
+            df = df[newer_than(df, since)]
+        if df.empty:
+            print("No new transactions to append")
+            return
+        months = sorted(_with_month(df)['month'].unique().tolist())
+        stored = _stored_months(clean_path, months, since)
+        rows = _with_month(compact(pd.concat([stored, df], ignore_index=True), TRANSACTIONS))
+        days = rows['timestamp'].dt.floor('D')
+        rows['transactions_per_day'] = rows.groupby(days)['timestamp'].transform('count')
+        compact(rows, TRANSACTIONS)
+        # Only the partitions written to are replaced, the other months stay as they are
+        write_parquet(rows.sort_values('timestamp', ignore_index=True), clean_path, partition_cols=['month'])
+
+        recomputed = daily_aggregates(rows)
+        try:
+            daily = read_arrow(daily_path)
+            kept = ~_with_month(daily)['month'].isin(months)
+            daily = pd.concat([daily[kept], recomputed], ignore_index=True).sort_values('timestamp', ignore_index=True)
+        except FileNotFoundError:
+            daily = recomputed
+        write_arrow(compact(daily, DAILY), daily_path)
+
+        high_water_mark = pd.to_datetime(df['timestamp']).max()
+        write_high_water_mark(clean_path, high_water_mark.isoformat())
+        print(f"Appended {len(df)} transactions to '{clean_path}', {len(months)} months and {len(recomputed)} days rewritten")
+    except Exception as e:
+        print(f"An error occurred while appending the clean data: {e}")
+
+def _stored_months(clean_path: str, months: list[int], since: str = '') -> pd.DataFrame:
+    '''Read the stored transactions of the given month partitions that are not newer than `since`.'''
+    if not since or not os.path.isdir(clean_path):
+        return pd.DataFrame()
+    stored = read_parquet(clean_path, filters=[('month', 'in', months)])
+    stored = compact(stored.drop(columns=['month']), TRANSACTIONS)
+    return stored[~newer_than(stored, since)]
+
+@step
+@instrumented
+def load_arrow(path: str) -> pd.DataFrame:
+    '''The function `load_arrow` memory-maps a DataFrame handed over by a previous pipeline.
+
+    Parameters
+    ----------
+    path : str
+        The Arrow IPC file, e.g. the daily aggregates written by the data pipeline.
+
+    Returns
+    -------
+        The stored DataFrame. If an error occurs, it will print an error message and return an empty
+    DataFrame.
+
+    '''
+    try:
+        return read_arrow(path)
+    except Exception as e:
+        print(f"An error occurred while reading '{path}': {e}")
+        return pd.DataFrame()
+
+@step
+@instrumented
+def load_forecasts(paths: list[str]) -> pd.DataFrame:
+    '''The function `load_forecasts` joins the forecast files written by the model pipeline into the frame
+    the synthetic data pipeline works on.
+
+    Parameters
+    ----------
+    paths : list[str]
+        The Arrow files of the forecasts, each holding 'timestamp' and one '<feature>_forecast' column.
+
+    Returns
+    -------
+        One row per forecast day with the 'timestamp' and every forecast column. If an error occurs, it
+    will print an error message and return an empty DataFrame.
+
+    '''
+    try:
+        combined_df = None
+        for path in paths:
+            df = read_arrow(path)
+            combined_df = df if combined_df is None else combined_df.merge(df, on='timestamp')
+        return combined_df.sort_values('timestamp', ignore_index=True)
+    except Exception as e:
+        print(f"An error occurred while reading the forecasts: {e}")
+        return pd.DataFrame()
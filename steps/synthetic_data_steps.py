@@ -1,16 +1,31 @@
 import os
+from concurrent.futures import as_completed
 import yaml
+import numpy as np
 import pandas as pd
 from zenml import pipeline, step
-from urllib.parse import quote_plus
-from pymongo.mongo_client import MongoClient
-from utils import generate_random_transactions_CTA, create_transactions_one_day
+from instrumentation import instrumented
+from database import get_client, read_frame
+from bootstrap import clear_collection, write_collection
+from schema import SYNTHETIC_TRANSACTIONS, compact
+from utils import create_transactions_batch, days, generate_transactions_batch, make_rng, process_pool
+
+# Scenario tag of the transactions of the single default run, so they can be told apart from a scenario matrix
+DEFAULT_SCENARIO = 'default'
+
+
+def tag_scenario(transactions_df: pd.DataFrame, name: str) -> pd.DataFrame:
+    '''Add the 'scenario' column holding `name` to the transactions, as a one-category column so the name
+    is not repeated per row.'''
+    transactions_df['scenario'] = pd.Categorical.from_codes(np.zeros(len(transactions_df), dtype=np.int8), categories=[name])
+    return transactions_df
 
 
 @step
-def read_data(mongo_uri: str, db_name: str, collection_names: list[str]) -> pd.DataFrame:
-    '''The function `read_data` reads data from MongoDB collections into a single pandas DataFrame,
-    handling exceptions for connection errors and other issues.
+@instrumented
+def read_forecast_store(mongo_uri: str, db_name: str, features: list[str], collection_name: str = 'Forecasts', periods: int = days) -> pd.DataFrame:
+    '''The function `read_forecast_store` reads the latest forecast horizon from the forecast store written
+    by the model pipeline, with one query on the `timestamp` index.
 
     Parameters
     ----------
@@ -18,38 +33,31 @@ def read_data(mongo_uri: str, db_name: str, collection_names: list[str]) -> pd.D
         The URI string for connecting to the MongoDB server.
     db_name : str
         The name of the MongoDB database.
-    collection_names : list[str]
-        A list of collection names from which data needs to be read.
+    features : list[str]
+        The forecast targets to read, e.g. ['transactions_per_day', 'CTA'].
+    collection_name : str, optional
+        The forecast store collection.
+    periods : int, optional
+        The number of forecast days to read, counted back from the last one.
 
     Returns
     -------
     pd.DataFrame
-        Returns a single pandas DataFrame with concatenated data from the specified MongoDB collections.
-        If an error occurs during the process, an empty DataFrame is returned.
+        One row per day with the 'timestamp' and the '<feature>_forecast' column of every feature, in date
+        order. If an error occurs during the process, an empty DataFrame is returned.
     '''
     try:
-        client = MongoClient(mongo_uri)
-        db = client[db_name]
-        
-        dfs = []
-        for collection_name in collection_names:
-            collection = db[collection_name]
-            cursor = collection.find()
-            df = pd.DataFrame(list(cursor))
-            df.drop(columns='_id',inplace=True)
-            dfs.append(df)
-        
-        
-        combined_df = pd.concat(dfs, axis=1)
-        combined_df = combined_df.loc[:, ~combined_df.columns.duplicated()]
-        combined_df.reset_index(drop=True, inplace=True)
-        
-        return combined_df
+        collection = get_client(mongo_uri)[db_name][collection_name]
+        columns = [feature + '_forecast' for feature in features]
+        df = read_frame(collection, {column: {'$exists': True} for column in columns}, ['timestamp'] + columns,
+                        sort=[('timestamp', -1)], limit=periods)
+        return df.iloc[::-1].reset_index(drop=True)
     except Exception as e:
-        print(f"An error occurred while reading data from MongoDB: {e}")
+        print(f"An error occurred while reading the forecast store: {e}")
         return pd.DataFrame()
 
 @step
+@instrumented
 def modify_forecasts(df: pd.DataFrame, trx_add: int = 0, trx_mul: int = 1, CTA_add: int = 0, CTA_mul: int = 1) -> pd.DataFrame:
     '''The function `modify_forecasts` takes a DataFrame and modifies two columns by adding and multiplying
     specified values, handling KeyError and other exceptions.
@@ -92,7 +100,8 @@ def modify_forecasts(df: pd.DataFrame, trx_add: int = 0, trx_mul: int = 1, CTA_a
     return df
 
 @step
-def generate_transactions(combined_df:pd.DataFrame)->pd.DataFrame:
+@instrumented
+def generate_transactions(combined_df:pd.DataFrame, seed:int = None)->pd.DataFrame:
     '''The function `generate_transactions` generates random transactions based on forecasts and adds them
     to a DataFrame.
     
@@ -101,8 +110,10 @@ def generate_transactions(combined_df:pd.DataFrame)->pd.DataFrame:
     combined_df
         Combined_df is a DataFrame containing forecasts for CTA (Call to Action) and transactions per day.
     The function `generate_transactions` takes this DataFrame as input and generates random transactions
-    based on the forecasts provided in the DataFrame. It iterates over each row in the DataFrame, using
-    the CTA forecast and
+    for all days at once with `generate_transactions_batch`, splitting each day's CTA forecast into its
+    forecast number of transactions.
+    seed : int, optional
+        The configured random seed, the transactions are drawn from its 'generate_transactions' stream.
     
     Returns
     -------
@@ -113,10 +124,10 @@ def generate_transactions(combined_df:pd.DataFrame)->pd.DataFrame:
     """Generate random transactions based on forecasts."""
     transactions = []
     try:
-        for idx in range(len(combined_df)):
-            transaction = generate_random_transactions_CTA(combined_df['CTA_forecast'][idx],
-                                                           combined_df['transactions_per_day_forecast'][idx])
-            transactions.append(transaction)
+        amounts, offsets = generate_transactions_batch(combined_df['CTA_forecast'].to_numpy(),
+                                                       combined_df['transactions_per_day_forecast'].to_numpy(),
+                                                       rng=make_rng(seed, 'generate_transactions'))
+        transactions = np.split(amounts, offsets[1:-1])
     except Exception as e:
         print(f"An error occurred while generating transactions: {e}")
     combined_df['transactions'] = transactions
@@ -124,10 +135,39 @@ def generate_transactions(combined_df:pd.DataFrame)->pd.DataFrame:
     return combined_df
 
 
+def explode_transactions(combined_df: pd.DataFrame, seed: int = None) -> pd.DataFrame:
+    '''The function `explode_transactions` turns the per-day 'transactions' lists of `combined_df` into one
+    columnar frame with a row per transaction, without iterating over the days.
+    
+    Parameters
+    ----------
+    combined_df : pd.DataFrame
+        The output of `generate_transactions`, with a 'timestamp' and a 'transactions' column.
+    seed : int, optional
+        The configured random seed, the times within each day are drawn from its 'transaction_times'
+    stream.
+    
+    Returns
+    -------
+        A DataFrame with the 'Timestamp' and 'Amount' of every transaction of every day, sorted by time.
+    
+    '''
+    transaction_lists = combined_df['transactions'].tolist()
+    counts = np.fromiter((len(transactions) for transactions in transaction_lists), dtype=np.int64, count=len(transaction_lists))
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    amounts = np.concatenate(transaction_lists).astype(np.int64) if offsets[-1] else np.zeros(0, dtype=np.int64)
+    transactions_df = create_transactions_batch(combined_df['timestamp'], amounts, offsets, rng=make_rng(seed, 'transaction_times'))
+    return compact(transactions_df, SYNTHETIC_TRANSACTIONS)
+
 @step
-def save_transactions_data_to_mongodb(combined_df: pd.DataFrame, mongo_uri: str, db_name: str, collection_name: str) -> None:
-    '''The function `save_transactions_data_to_mongodb` saves transaction data from a combined DataFrame to MongoDB.'''
-    client = MongoClient(mongo_uri)
+@instrumented
+def save_transactions_data_to_mongodb(combined_df: pd.DataFrame, mongo_uri: str, db_name: str, collection_name: str, batch_size: int = 10_000, workers: int = 1, seed: int = None, layout: str = 'plain') -> None:
+    '''The function `save_transactions_data_to_mongodb` saves transaction data from a combined DataFrame to MongoDB.
+    The transactions of all days are exploded into one frame by `explode_transactions` and streamed
+    through a `BulkWriter` in batches of `batch_size` documents, into the collection `layout` from
+    `bootstrap.LAYOUTS`. They are tagged with the `DEFAULT_SCENARIO` scenario.'''
+    client = get_client(mongo_uri)
     # Send a ping to confirm a successful connection
     try:
         client.admin.command('ping')
@@ -137,29 +177,128 @@ def save_transactions_data_to_mongodb(combined_df: pd.DataFrame, mongo_uri: str,
         return  # Exit if connection fails
 
     db = client[db_name]
-    collection = db[collection_name]
 
     # Delete previous data from the collection
     try:
-        result = collection.delete_many({})
-        print(f"Deleted {result.deleted_count} documents from collection '{collection_name}'")
+        deleted = clear_collection(db, collection_name, layout)
+        print(f"Deleted {deleted} documents from collection '{collection_name}'")
     except Exception as e:
         print(f"An error occurred while deleting previous data: {e}")
         return  # Exit if deletion fails
 
     # Insert fresh data into the collection
     try:
-        for idx, row in combined_df.iterrows():
-            date = row['timestamp'].date()
-            transaction_lists = row['transactions']
-            df = create_transactions_one_day(date, transaction_lists)
-            df = df.sort_values("Timestamp").reset_index(drop=True)
-            records = df.to_dict(orient='records')
-            collection.insert_many(records)
-            print(f"Data saved to MongoDB for date {date}")
+        transactions_df = tag_scenario(explode_transactions(combined_df, seed), DEFAULT_SCENARIO)
+        write_collection(db, collection_name, transactions_df, layout, batch_size, workers)
     except Exception as e:
         print(f"An error occurred while saving data to MongoDB: {e}")
 
 
+def run_scenario(combined_df: pd.DataFrame, scenario: dict, mongo_uri: str, db_name: str, collection_name: str, batch_size: int = 10_000, workers: int = 1, rng: np.random.Generator = None, layout: str = 'plain') -> dict:
+    '''The function `run_scenario` generates the synthetic transactions of one scenario and writes them to
+    MongoDB tagged with the scenario name. It only needs picklable arguments, so it can run in a worker
+    process.
+    
+    Parameters
+    ----------
+    combined_df : pd.DataFrame
+        The forecasts returned by `read_forecast_store` or `load_forecasts`, shared by all scenarios and left unchanged.
+    scenario : dict
+        The scenario settings: 'name' (required), the `modify_forecasts` factors 'trx_add', 'trx_mul',
+    'CTA_add' and 'CTA_mul', an optional 'seed' and an optional 'days' horizon, which is capped at the
+    number of forecast days.
+    mongo_uri : str
+        The URI string for connecting to the MongoDB server.
+    db_name : str
+        The name of the MongoDB database.
+    collection_name : str
+        The collection the transactions are written to, previous documents of the same scenario are
+    replaced.
+    batch_size : int, optional
+        The number of documents per insert batch.
+    workers : int, optional
+        The number of threads sending insert batches concurrently.
+    rng : numpy.random.Generator, optional
+        The random generator of the scenario, used when the scenario has no 'seed' of its own.
+    layout : str, optional
+        The layout of the collection, see `bootstrap.LAYOUTS`.
+    
+    Returns
+    -------
+        The write statistics of the scenario, see `BulkWriter.close`.
+    
+    '''
+    name = scenario['name']
+    df = combined_df.head(scenario['days']) if scenario.get('days') else combined_df
+    trx_forecast = (df['transactions_per_day_forecast'] + scenario.get('trx_add', 0)) * scenario.get('trx_mul', 1)
+    CTA_forecast = (df['CTA_forecast'] + scenario.get('CTA_add', 0)) * scenario.get('CTA_mul', 1)
+
+    if scenario.get('seed') is not None:
+        rng = np.random.default_rng(scenario['seed'])
+    elif rng is None:
+        rng = np.random.default_rng()
+    amounts, offsets = generate_transactions_batch(CTA_forecast.to_numpy(), trx_forecast.to_numpy(), rng=rng)
+    transactions_df = create_transactions_batch(df['timestamp'], amounts, offsets, rng=rng)
+    transactions_df = compact(tag_scenario(transactions_df, name), SYNTHETIC_TRANSACTIONS)
+
+    db = get_client(mongo_uri)[db_name]
+    deleted = clear_collection(db, collection_name, layout, {'scenario': name})
+    print(f"Deleted {deleted} documents of scenario '{name}' from collection '{collection_name}'")
+    return write_collection(db, collection_name, transactions_df, layout, batch_size, workers)
+
+@step
+@instrumented
+def generate_scenarios(combined_df: pd.DataFrame, scenarios: list[dict], mongo_uri: str, db_name: str, collection_name: str, batch_size: int = 10_000, workers: int = 1, max_workers: int = None, seed: int = None, layout: str = 'plain') -> None:
+    '''The function `generate_scenarios` fans a matrix of synthetic data scenarios out across a process
+    pool. The forecasts are read once and shared by every scenario, each of which is written to
+    `collection_name` under its own 'scenario' tag by `run_scenario`. The transactions of the default run
+    are deleted first.
+    
+    Parameters
+    ----------
+    combined_df : pd.DataFrame
+        The forecasts returned by `read_forecast_store` or `load_forecasts`.
+    scenarios : list[dict]
+        The scenario settings, see `run_scenario`.
+    mongo_uri : str
+        The URI string for connecting to the MongoDB server.
+    db_name : str
+        The name of the MongoDB database.
+    collection_name : str
+        The collection all scenarios are written to.
+    batch_size : int, optional
+        The number of documents per insert batch.
+    workers : int, optional
+        The number of threads sending insert batches concurrently within each scenario.
+    max_workers : int, optional
+        The number of worker processes, defaults to the CPU count.
+    seed : int, optional
+        The configured random seed. Scenarios without a 'seed' of their own get independent generators
+    spawned from its 'scenarios' stream, so the results do not depend on which worker runs them.
+    layout : str, optional
+        The layout of the collection, see `bootstrap.LAYOUTS`.
+    
+    '''
+    max_workers = max_workers or min(len(scenarios), os.cpu_count() or 1)
+    # The transactions of an earlier default run, tagged or from before runs were tagged, would otherwise be
+    # mixed into unfiltered reads of the scenarios
+    try:
+        deleted = clear_collection(get_client(mongo_uri)[db_name], collection_name, layout, {'scenario': {'$in': [None, DEFAULT_SCENARIO]}})
+        print(f"Deleted {deleted} documents of the default run from collection '{collection_name}'")
+    except Exception as e:
+        print(f"An error occurred while deleting the default run: {e}")
+    rngs = make_rng(seed, 'scenarios').spawn(len(scenarios))
+    with process_pool(max_workers) as executor:
+        futures = {executor.submit(run_scenario, combined_df, scenario, mongo_uri, db_name, collection_name, batch_size, workers, rng, layout): scenario['name']
+                   for scenario, rng in zip(scenarios, rngs)}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                stats = future.result()
+                print(f"Scenario '{name}' saved {stats['documents']} transactions to MongoDB")
+            except Exception as e:
+                print(f"An error occurred while generating scenario '{name}': {e}")
+
+
 if __name__ == "__main__":
     pass
\ No newline at end of file
@@ -0,0 +1,108 @@
+import holidays
+import numpy as np
+import pandas as pd
+
+# Registry of calendar features, name -> function(timestamps, options) returning a Categorical
+TIME_FEATURES = {}
+
+# Features built by `add_time_features` when no explicit list is configured
+DEFAULT_TIME_FEATURES = ['day_night', 'weekend', 'season']
+
+def register_time_feature(name: str):
+    '''The function `register_time_feature` is a decorator that adds a calendar feature to the
+    `TIME_FEATURES` registry under the given name.
+
+    Parameters
+    ----------
+    name : str
+        The name of the feature, which is also the name of the column it produces.
+
+    Returns
+    -------
+        A decorator registering a function that takes the timestamp Series and a dict of options and
+    returns a pandas Categorical with one value per timestamp.
+
+    '''
+    def decorator(func):
+        TIME_FEATURES[name] = func
+        return func
+    return decorator
+
+def _from_lookup(keys: np.ndarray, table: np.ndarray, categories: list[str]) -> pd.Categorical:
+    '''Map integer calendar keys (hour, weekday, month) to category codes through a lookup table.'''
+    if keys.dtype.kind == 'f':
+        # NaT timestamps give NaN keys, which become missing values
+        valid = ~np.isnan(keys)
+        codes = np.full(len(keys), -1, dtype=np.int8)
+        codes[valid] = table[keys[valid].astype(np.int64)]
+        return pd.Categorical.from_codes(codes, categories=categories)
+    return pd.Categorical.from_codes(table[keys], categories=categories)
+
+# Lookup tables indexed by hour (0-23), weekday (0-6) and month (1-12) holding category codes
+_DAY_NIGHT_BY_HOUR = np.array([1] * 6 + [0] * 12 + [1] * 6, dtype=np.int8)
+_WEEKEND_BY_WEEKDAY = np.array([0, 0, 0, 0, 0, 1, 1], dtype=np.int8)
+_SEASON_BY_MONTH = np.array([-1, 3, 3, 0, 0, 0, 1, 1, 1, 2, 2, 2, 3], dtype=np.int8)
+_HOUR_BUCKET_BY_HOUR = np.repeat(np.arange(4, dtype=np.int8), 6)
+
+@register_time_feature('day_night')
+def day_night(timestamps: pd.Series, options: dict) -> pd.Categorical:
+    '''Day between 06:00 and 18:00, night otherwise.'''
+    return _from_lookup(timestamps.dt.hour.to_numpy(), _DAY_NIGHT_BY_HOUR, ['day', 'night'])
+
+@register_time_feature('weekend')
+def weekend(timestamps: pd.Series, options: dict) -> pd.Categorical:
+    '''Whether the transaction happened on a Saturday or Sunday.'''
+    return _from_lookup(timestamps.dt.weekday.to_numpy(), _WEEKEND_BY_WEEKDAY, ['no', 'yes'])
+
+@register_time_feature('season')
+def season(timestamps: pd.Series, options: dict) -> pd.Categorical:
+    '''Meteorological season of the northern hemisphere.'''
+    return _from_lookup(timestamps.dt.month.to_numpy(), _SEASON_BY_MONTH, ['Spring', 'Summer', 'Autumn', 'Winter'])
+
+@register_time_feature('hour_bucket')
+def hour_bucket(timestamps: pd.Series, options: dict) -> pd.Categorical:
+    '''Six-hour bucket of the day the transaction falls in.'''
+    return _from_lookup(timestamps.dt.hour.to_numpy(), _HOUR_BUCKET_BY_HOUR, ['night', 'morning', 'afternoon', 'evening'])
+
+@register_time_feature('month_end')
+def month_end(timestamps: pd.Series, options: dict) -> pd.Categorical:
+    '''Whether the transaction happened on the last day of its month.'''
+    return pd.Categorical.from_codes(timestamps.dt.is_month_end.to_numpy().astype(np.int8), categories=['no', 'yes'])
+
+@register_time_feature('holiday')
+def holiday(timestamps: pd.Series, options: dict) -> pd.Categorical:
+    '''Whether the transaction happened on a public holiday of `options['holiday_country']` (default US).'''
+    dates = timestamps.dt.tz_localize(None) if timestamps.dt.tz is not None else timestamps
+    dates = dates.dt.normalize()
+    years = dates.dt.year.unique().tolist()
+    calendar = holidays.country_holidays(options.get('holiday_country', 'US'), years=years)
+    is_holiday = dates.isin(pd.to_datetime(list(calendar.keys()))).to_numpy()
+    return pd.Categorical.from_codes(is_holiday.astype(np.int8), categories=['no', 'yes'])
+
+def build_time_features(timestamps: pd.Series, features: list[str] = None, options: dict = None) -> pd.DataFrame:
+    '''The function `build_time_features` computes calendar features for a column of timestamps using the
+    vectorized functions in the `TIME_FEATURES` registry.
+
+    Parameters
+    ----------
+    timestamps : pd.Series
+        A Series of datetime values.
+    features : list[str], optional
+        The names of the registered features to build, `DEFAULT_TIME_FEATURES` if not given.
+    options : dict, optional
+        Options passed to every feature function, e.g. `holiday_country` for the holiday flag.
+
+    Returns
+    -------
+        A DataFrame indexed like `timestamps` with one categorical column per feature. A `KeyError` is
+    raised for a feature name that is not registered.
+
+    '''
+    features = DEFAULT_TIME_FEATURES if features is None else features
+    options = options or {}
+    columns = {}
+    for name in features:
+        if name not in TIME_FEATURES:
+            raise KeyError(f"Unknown time feature '{name}', registered features are {sorted(TIME_FEATURES)}")
+        columns[name] = TIME_FEATURES[name](timestamps, options)
+    return pd.DataFrame(columns, index=timestamps.index)
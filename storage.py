@@ -0,0 +1,122 @@
+import json
+import os
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+# Written inside a Parquet dataset directory, the leading underscore keeps it out of the dataset
+HIGH_WATER_MARK_FILE = '_high_water_mark.json'
+
+
+def write_arrow(df: pd.DataFrame, path: str) -> None:
+    '''The function `write_arrow` writes a DataFrame to an uncompressed Arrow IPC file, the format that can
+    be memory-mapped back without decoding.
+
+    The file is written next to its destination and then renamed, so readers never see a partial file.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The frame to store.
+    path : str
+        The destination file, its directory is created if needed.
+    '''
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    feather.write_feather(df.reset_index(drop=True), tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+
+
+def read_arrow(path: str, columns: list[str] = None) -> pd.DataFrame:
+    '''The function `read_arrow` memory-maps an Arrow IPC file written by `write_arrow`.
+
+    Numeric columns without nulls are handed to pandas without copying, they stay backed by the page
+    cache of the mapped file.
+
+    Parameters
+    ----------
+    path : str
+        The Arrow IPC file.
+    columns : list[str], optional
+        The columns to read, all of them when not given.
+
+    Returns
+    -------
+        The stored DataFrame.
+    '''
+    with pa.memory_map(path, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def write_parquet(df: pd.DataFrame, path: str, partition_cols: list[str] = None) -> None:
+    '''The function `write_parquet` writes a DataFrame to a Parquet dataset directory.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The frame to store.
+    path : str
+        The dataset directory.
+    partition_cols : list[str], optional
+        Columns to partition the dataset by, e.g. a month column for the clean transactions. Only the
+    partitions `df` has rows for are replaced, the others are kept.
+    '''
+    table = pa.Table.from_pandas(df.reset_index(drop=True), preserve_index=False)
+    ds.write_dataset(table, path, format='parquet', partitioning=partition_cols, partitioning_flavor='hive',
+                     existing_data_behavior='delete_matching')
+
+
+def read_parquet(path: str, columns: list[str] = None, filters=None) -> pd.DataFrame:
+    '''The function `read_parquet` reads a Parquet dataset written by `write_parquet`, memory-mapping its
+    files and skipping the partitions and row groups excluded by `filters`.
+
+    Parameters
+    ----------
+    path : str
+        The dataset directory.
+    columns : list[str], optional
+        The columns to read, all of them when not given.
+    filters : optional
+        Row filters in the `pyarrow.parquet` list-of-tuples form, e.g. `[('timestamp', '>=', start)]`.
+
+    Returns
+    -------
+        The stored DataFrame, with partition columns restored.
+    '''
+    table = pq.read_table(path, columns=columns, filters=filters, memory_map=True)
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def read_high_water_mark(path: str) -> str:
+    '''Return the high-water mark stored in a Parquet dataset directory, or an empty string.'''
+    try:
+        with open(os.path.join(path, HIGH_WATER_MARK_FILE), 'r') as f:
+            return json.load(f).get('high_water_mark') or ''
+    except FileNotFoundError:
+        return ''
+
+
+def write_high_water_mark(path: str, high_water_mark: str) -> None:
+    '''Store the high-water mark of a Parquet dataset directory.'''
+    os.makedirs(path, exist_ok=True)
+    tmp_path = os.path.join(path, HIGH_WATER_MARK_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump({'high_water_mark': high_water_mark}, f)
+    os.replace(tmp_path, os.path.join(path, HIGH_WATER_MARK_FILE))
+
+
+def forecast_path(config: dict, feature: str) -> str:
+    '''The function `forecast_path` returns the Arrow file holding the forecast of a feature, from the
+    `paths` section of `config.yaml`. Features without a configured file are stored as `<feature>.arrow`
+    in the `predicted_data_directory`.'''
+    paths = config['paths']
+    configured = {
+        'transactions_per_day': paths.get('transactions_per_day_output_file'),
+        'CTA': paths.get('cta_output_file'),
+    }
+    return configured.get(feature) or os.path.join(paths.get('predicted_data_directory', 'Data/Predicted_Data'), f'{feature}.arrow')
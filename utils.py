@@ -1,5 +1,7 @@
 import datetime
-import random
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
 import yaml
 
@@ -11,7 +13,61 @@ def load_config(config_file):
 config = load_config('config.yaml')
 days = config['utils']['days']
 
-def generate_random_transactions_CTA(target_number, divisor):
+# Independent random streams derived from one configured seed, one per consumer, so adding draws
+# to one step never shifts the numbers of another
+RNG_STREAMS = {
+    'generate_CTA': 0,
+    'generate_transactions': 1,
+    'transaction_times': 2,
+    'scenarios': 3,
+}
+
+def make_rng(seed=None, stream=None):
+    '''The function `make_rng` creates the `numpy.random.Generator` of one random stream.
+
+    Parameters
+    ----------
+    seed : int, optional
+        The seed from the `random.seed` setting of `config.yaml`. Without one the generator is seeded from
+        the operating system and runs are not reproducible.
+    stream : str or int, optional
+        The name of a stream in `RNG_STREAMS`, or its number. Each stream of the same seed is
+        statistically independent.
+
+    Returns
+    -------
+    numpy.random.Generator
+        The generator of the stream. Use `Generator.spawn` to split it further for parallel or chunked
+    work.
+    '''
+    if seed is None:
+        return np.random.default_rng()
+    spawn_key = () if stream is None else (RNG_STREAMS.get(stream, stream),)
+    return np.random.default_rng(np.random.SeedSequence(seed, spawn_key=spawn_key))
+
+def process_pool(max_workers=None):
+    '''The function `process_pool` creates the process pool the model and synthetic data steps fan their
+    work out to.
+
+    The workers are started with 'spawn' rather than forked. A forked child inherits the memory of the
+    API process, including locks held at that moment by its threads and the sockets of the pooled Mongo
+    client, which can deadlock or corrupt the connection. A spawned child starts a fresh interpreter and
+    opens its own client.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        The number of worker processes, the number of CPUs when not given.
+
+    Returns
+    -------
+    concurrent.futures.ProcessPoolExecutor
+        The pool, to be used as a context manager. Everything submitted to it must be picklable.
+    '''
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+
+def generate_random_transactions_CTA(target_number, divisor, rng=None):
+    rng = rng if rng is not None else np.random.default_rng()
     transactions = []
 
     try:
@@ -21,7 +77,7 @@ def generate_random_transactions_CTA(target_number, divisor):
             result = current_value / divisor
 
             # Generating a random number within the range from 1 to result
-            random_number = random.randint(1, int(result))
+            random_number = int(rng.integers(1, int(result), endpoint=True))
 
             # Subtracting random_number from the current value
             current_value -= random_number
@@ -50,21 +106,98 @@ def generate_random_transactions_CTA(target_number, divisor):
 
     return transactions
 
-def create_transactions_one_day(date, transaction_lists):
-    random_transactions = []  # List to store transactions with random times
-
+def generate_transactions_batch(targets, divisors, seed=None, rng=None):
+    '''The function `generate_transactions_batch` is the vectorized counterpart of
+    `generate_random_transactions_CTA`: it splits the target amount of every forecast day into random
+    positive transactions in one NumPy pass.
+
+    Parameters
+    ----------
+    targets
+        The target total amount of each day, e.g. the 'CTA_forecast' column.
+    divisors
+        The number of transactions of each day, e.g. the 'transactions_per_day_forecast' column. Like
+        `generate_random_transactions_CTA`, a day always gets at least one transaction.
+    seed : int, optional
+        The seed of the random generator, used when `rng` is not given.
+    rng : numpy.random.Generator, optional
+        The random generator to draw from.
+
+    Returns
+    -------
+        A tuple `(amounts, offsets)` where `amounts` is a flat int64 array of all transactions and the
+    transactions of day `i` are `amounts[offsets[i]:offsets[i + 1]]`. Each day's transactions sum exactly
+    to its (whole, non-negative) target, and are at least 1 whenever the target allows it.
+    '''
+    rng = rng if rng is not None else np.random.default_rng(seed)
+    targets = np.maximum(np.asarray(targets, dtype=np.float64), 0).astype(np.int64)
+    counts = np.maximum(np.floor(np.asarray(divisors, dtype=np.float64)), 1).astype(np.int64)
+
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    if offsets[-1] == 0:
+        return np.zeros(0, dtype=np.int64), offsets
+    day = np.repeat(np.arange(len(counts)), counts)
+
+    # Normalized exponential weights split each day's target uniformly at random
+    weights = rng.exponential(size=offsets[-1])
+    shares = weights / np.bincount(day, weights, minlength=len(counts))[day]
+
+    # Every transaction gets 1 when the target covers it, the rest is shared out by weight
+    minimum = (targets >= counts).astype(np.int64)
+    spread = targets - minimum * counts
+    amounts = minimum[day] + np.floor(shares * spread[day]).astype(np.int64)
+
+    # Rounding leftovers go to the last transaction of each day so the totals are exact
+    amounts[offsets[1:] - 1] += targets - np.add.reduceat(amounts, offsets[:-1])
+    return amounts, offsets
+
+def create_transactions_batch(dates, amounts, offsets, seed=None, rng=None):
+    '''The function `create_transactions_batch` gives every transaction of the forecast horizon a random
+    time within its day in one vectorized pass and returns them as a single frame.
+
+    Parameters
+    ----------
+    dates
+        The day of each forecast day, anything `pd.to_datetime` accepts. Times of day are ignored.
+    amounts
+        The flat array of transaction amounts of all days, as returned by `generate_transactions_batch`.
+    offsets
+        The offsets of each day's transactions in `amounts`, day `i` spans `offsets[i]:offsets[i + 1]`.
+    seed : int, optional
+        The seed of the random generator, used when `rng` is not given.
+    rng : numpy.random.Generator, optional
+        The random generator to draw from.
+
+    Returns
+    -------
+        A DataFrame with the 'Timestamp' (second resolution) and 'Amount' of every transaction, sorted by
+    time once for the whole horizon.
+    '''
+    rng = rng if rng is not None else np.random.default_rng(seed)
+    amounts = np.asarray(amounts)
+    counts = np.diff(np.asarray(offsets, dtype=np.int64))
+    days = pd.to_datetime(pd.Series(dates)).dt.tz_localize(None).to_numpy().astype('datetime64[D]')
+
+    # Random second of the day added to each transaction's day, as epoch seconds since sorting plain
+    # integers is several times faster than sorting datetime64 values
+    seconds = np.repeat(days.astype('datetime64[s]').astype(np.int64), counts)
+    seconds += rng.integers(0, 24 * 60 * 60, size=len(amounts))
+
+    order = np.argsort(seconds)
+    return pd.DataFrame({'Timestamp': seconds[order].astype('datetime64[s]'), 'Amount': amounts[order]})
+
+def create_transactions_one_day(date, transaction_lists, rng=None):
+    '''The function `create_transactions_one_day` gives each transaction amount of one day a random time
+    within that day, see `create_transactions_batch` for all days at once.
+
+    Returns
+    -------
+        A DataFrame with the 'Timestamp' and 'Amount' of the day's transactions, sorted by time.
+    '''
+    amounts = np.asarray(list(transaction_lists))
     try:
-        for amount in transaction_lists:
-            # Generate a random time within the day
-            random_hour = random.randint(0, 23)
-            random_minute = random.randint(0, 59)
-            random_second = random.randint(0, 59)
-            random_time = datetime.datetime.combine(date, datetime.time(random_hour, random_minute, random_second))
-            random_transactions.append((random_time, amount))
+        return create_transactions_batch([date], amounts, [0, len(amounts)], rng=rng)
     except Exception as e:
         print(f"Error occurred: {e}")
-
-    # Create pandas DataFrame from the list of tuples
-    df = pd.DataFrame(random_transactions, columns=['Timestamp', 'Amount'])
-
-    return df
+        return pd.DataFrame(columns=['Timestamp', 'Amount'])